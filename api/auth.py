@@ -0,0 +1,117 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenError(Exception):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def load_secret(path, env_value=None):
+    # Секрет берётся из переменной окружения или из локального файла, который создаётся при первом запуске.
+    # Файл появляется под своим именем уже записанным (через os.link), поэтому воркеры, стартующие
+    # одновременно, либо создают его, либо читают созданный другим, но не видят пустым
+    if env_value:
+        return env_value.encode()
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    secret = secrets.token_bytes(32)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    try:
+        os.link(temp_path, path)
+    except FileExistsError:
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.unlink(temp_path)
+    return secret
+
+
+class TokenManager:
+    # Подписанные HMAC токены с ролью пользователя: проверка не обращается к базе.
+    # Отзывы из других процессов передаются в apply_revocations тем, кто читает их из базы
+    def __init__(self, secret, ttl=8 * 3600, cache_size=1024, cache_ttl=60):
+        self.secret = secret
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()
+        self._revoked = {}
+        # Время самого нового полученного отзыва: следующие запрашиваются начиная с него
+        self.revocations_seen = 0.0
+        self._lock = threading.Lock()
+
+    def _sign(self, payload):
+        return _b64encode(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, username, role):
+        now = time.time()
+        payload = _b64encode(json.dumps({"sub": username, "role": role, "iat": now, "exp": now + self.ttl}).encode())
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token):
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(token)
+            if cached is not None and cached[1] > now:
+                self._cache.move_to_end(token)
+                claims = cached[0]
+            else:
+                claims = None
+        if claims is None:
+            claims = self._decode(token, now)
+            with self._lock:
+                self._cache[token] = (claims, min(claims["exp"], now + self.cache_ttl))
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        if claims["exp"] <= now:
+            raise TokenError("Token expired")
+        revoked_at = self._revoked.get(claims["sub"])
+        if revoked_at is not None and claims["iat"] <= revoked_at:
+            raise TokenError("Token revoked")
+        return claims["sub"], claims["role"]
+
+    def _decode(self, token, now):
+        payload, _, signature = token.partition(".")
+        # Сравниваются байты: compare_digest не принимает строки с не-ASCII символами
+        if not signature or not hmac.compare_digest(signature.encode(), self._sign(payload).encode()):
+            raise TokenError("Invalid token")
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            raise TokenError("Invalid token")
+        if claims["exp"] <= now:
+            raise TokenError("Token expired")
+        return claims
+
+    def apply_revocations(self, revocations):
+        # revocations - список (username, revoked_at), например из BookingModel.get_token_revocations
+        with self._lock:
+            for username, revoked_at in revocations:
+                self._revoked[username] = max(self._revoked.get(username, 0.0), revoked_at)
+                self.revocations_seen = max(self.revocations_seen, revoked_at)
+
+    def revoke_user(self, username):
+        # Все токены пользователя, выданные до этого момента, перестают приниматься
+        with self._lock:
+            self._revoked[username] = time.time()
@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger("api.events")
+
+# Сколько событий читается из журнала за один запрос
+EVENT_BATCH = 500
+
+
+class EventBroker:
+    # Рассылка событий по заказам открытым потокам /bookings/events этого процесса.
+    # Источник - журнал booking_events в базе: один цикл на процесс читает новые события сразу после записи
+    # в этом процессе (notify) и не реже раза в poll_interval - записанные другими воркерами.
+    # Последние события держатся в памяти, чтобы потоки не ходили в базу; отстающие дочитывают из журнала.
+    def __init__(self, model, poll_interval=0.5, buffer_size=1000, heartbeat_interval=15.0, retention=24 * 3600,
+                 prune_interval=3600):
+        self.model = model
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.last_id = 0
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Condition()
+        self._task = None
+
+    async def start(self):
+        _, self.last_id = await self.model.get_event_bounds()
+        self._task = asyncio.create_task(self._poll())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        # Вызывается обработчиками после записи: событие уже в журнале, остаётся разбудить цикл
+        self._wakeup.set()
+
+    async def _poll(self):
+        pruned_at = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                events = await self.model.get_events(self.last_id, EVENT_BATCH)
+                while events:
+                    async with self._changed:
+                        self._buffer.extend(events)
+                        self.last_id = events[-1][0]
+                        self._changed.notify_all()
+                    if len(events) < EVENT_BATCH:
+                        break
+                    events = await self.model.get_events(self.last_id, EVENT_BATCH)
+                if time.monotonic() - pruned_at > self.prune_interval:
+                    pruned_at = time.monotonic()
+                    await self.model.prune_events(time.time() - self.retention)
+            except Exception:
+                logger.exception("Failed to read booking events")
+
+    async def _is_lost(self, cursor):
+        # Клиент просит продолжить с события, которого в журнале уже (или ещё) нет
+        oldest, last = await self.model.get_event_bounds()
+        if cursor > last:
+            return True
+        return cursor < last and (oldest is None or cursor < oldest - 1)
+
+    async def subscribe(self, last_event_id=None, max_age=None):
+        # Асинхронный генератор событий (id, kind, data) с номером больше last_event_id;
+        # None - давно не было событий и пора отправить клиенту keep-alive.
+        # Через max_age секунд генератор завершается: клиент переподключится с последним полученным номером
+        deadline = time.monotonic() + max_age if max_age is not None else None
+        cursor = self.last_id
+        if last_event_id is not None:
+            if await self._is_lost(last_event_id):
+                # Пропущенные события восстановить нельзя: клиент должен перечитать список целиком
+                yield cursor, "reset", "{}"
+            else:
+                cursor = last_event_id
+        while True:
+            heartbeat = False
+            timeout = self.heartbeat_interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                timeout = min(timeout, remaining)
+            async with self._changed:
+                if cursor >= self.last_id:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        heartbeat = True
+                buffered = bool(self._buffer) and cursor >= self._buffer[0][0] - 1
+                pending = [event for event in self._buffer if event[0] > cursor] if buffered else None
+            if heartbeat:
+                yield None
+                continue
+            if pending is None:
+                pending = await self.model.get_events(cursor, EVENT_BATCH)
+                if not pending:
+                    cursor = self.last_id
+            for event in pending:
+                yield event
+                cursor = event[0]
@@ -0,0 +1,142 @@
+import threading
+import time
+from bisect import bisect_left
+from db.tracing import trace_queries
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, **labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+        cumulative += self.counts[-1]
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {cumulative}")
+        suffix = _labels(**labels) if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Metrics:
+    # Счётчики и гистограммы в памяти процесса, отдаются в текстовом формате Prometheus
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.request_latency = {}
+        self.db_block_latency = Histogram()
+        self.db_connections_opened = 0
+        self.db_transactions = {"commit": 0, "rollback": 0}
+
+    def observe_request(self, method, route, status, duration):
+        with self._lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.request_latency.get((method, route))
+            if histogram is None:
+                histogram = self.request_latency[(method, route)] = Histogram()
+            histogram.observe(duration)
+
+    # Получатель событий Database
+    def connection_opened(self):
+        with self._lock:
+            self.db_connections_opened += 1
+
+    def connection_block(self, duration):
+        with self._lock:
+            self.db_block_latency.observe(duration)
+
+    def transaction_finished(self, outcome):
+        with self._lock:
+            self.db_transactions[outcome] += 1
+
+    def render(self, gauges=None, counters=None):
+        with self._lock:
+            lines = ["# TYPE http_requests_total counter"]
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            for (method, route), histogram in sorted(self.request_latency.items()):
+                lines.extend(histogram.render("http_request_duration_seconds", method=method, route=route))
+            lines.append("# TYPE db_connection_block_duration_seconds histogram")
+            lines.extend(self.db_block_latency.render("db_connection_block_duration_seconds"))
+            lines.append("# TYPE db_connections_opened_total counter")
+            lines.append(f"db_connections_opened_total {self.db_connections_opened}")
+            lines.append("# TYPE db_transactions_total counter")
+            for outcome, count in self.db_transactions.items():
+                lines.append(f"db_transactions_total{_labels(outcome=outcome)} {count}")
+        for kind, values in (("gauge", gauges), ("counter", counters)):
+            for name, value in (values or {}).items():
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    # ASGI-мидлварь: время и статус каждого запроса по шаблону маршрута, а не по фактическому пути
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            self.metrics.observe_request(scope["method"], route.path if route else "unmatched", status,
+                                         time.perf_counter() - started)
+
+
+class QueryTraceMiddleware:
+    # Включается настройкой EVENTS_SQL_TRACE: число запросов к базе и их суммарное время в заголовках ответа
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with trace_queries() as trace:
+            async def send_with_trace(message):
+                if message["type"] == "http.response.start":
+                    trace.finish()
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-queries", str(trace.count).encode()))
+                    headers.append((b"x-db-time", f"{trace.total_time * 1000:.3f}".encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace)
+        trace.log(f"{scope['method']} {scope['path']}")
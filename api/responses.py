@@ -0,0 +1,120 @@
+import json
+import zlib
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него используется стандартный json
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # без модуля brotli ответы сжимаются только gzip
+    brotli = None
+
+
+class FastJSONResponse(JSONResponse):
+    # Для больших списков из dict: сериализация без обхода jsonable_encoder.
+    # Содержимое должно состоять только из dict, list, str, int, float, bool и None
+    def render(self, content):
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        # Отдаём накопленное, чтобы потоковые ответы доходили до клиента по частям
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    # Сжатие ответов gzip или brotli по заголовку Accept-Encoding; маленькие ответы и SSE отдаются как есть
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _negotiate(self, accept_encoding):
+        accepted = {item.split(";")[0].strip().lower() for item in accept_encoding.split(",")}
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def _compressor(self, encoding):
+        return _BrotliCompressor(self.brotli_quality) if encoding == "br" else _GzipCompressor(self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http":
+            encoding = self._negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Заголовки отправляются вместе с первой частью тела, когда станет ясно, сжимать ли ответ
+                start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if ("content-encoding" in headers or headers.get("content-type", "").startswith("text/event-stream")
+                        or (not more_body and len(body) < self.minimum_size)):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = self._compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                chunk = compressor.compress(body) + (compressor.flush() if more_body else compressor.finish())
+                if not more_body:
+                    headers["Content-Length"] = str(len(chunk))
+                await send(start_message)
+            else:
+                chunk = compressor.compress(body) + (compressor.flush() if more_body else compressor.finish())
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
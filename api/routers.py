@@ -1,172 +1,517 @@
-from fastapi import FastAPI, HTTPException, Depends, Security
+from contextlib import asynccontextmanager
+from typing import Optional, Union
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, Security
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
-from api.schemas import BookingCreate, ProgramCreate, AddonCreate, MasterclassCreate, UserCreate
+from pydantic import ValidationError
+from api.auth import TokenError, TokenManager, load_secret
+from api.events import EventBroker
+from api.metrics import Metrics, MetricsMiddleware, QueryTraceMiddleware
+from api.responses import CompressionMiddleware, FastJSONResponse
+from api.schemas import BookingCreate, ProgramCreate, AddonCreate, MasterclassCreate, QuoteRequest, UserCreate
 from db.database import Database
-from db.models import BookingModel
+from db.models import AsyncBookingModel, BookingModel, CapacityExceededError
+from db.pricing import PriceError
+from db.writer import WriteQueue
+import config
+import asyncio
+import datetime
+import base64
+import binascii
+import csv
+import io
 import json
+import logging
 
-app = FastAPI()
+
+logger = logging.getLogger("api.routers")
+
+
+async def refresh_shared_state(app):
+    # Версия каталога и отзывы токенов, изменённые другими процессами (воркерами, GUI, скриптами),
+    # читаются через пул потоков базы: обработчики запросов проверяют только состояние в памяти
+    model, tokens = app.state.model, app.state.tokens
+    await model.refresh_catalog_version()
+    tokens.apply_revocations(await model.get_token_revocations(tokens.revocations_seen))
+
+
+async def refresh_shared_state_forever(app, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_shared_state(app)
+        except Exception:
+            logger.exception("Failed to refresh shared state")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # База и модель создаются один раз на всё время работы приложения
+    db = Database(config.DB_NAME, listener=metrics)
+    app.state.db = db
+    write_queue = None
+    if config.WRITE_QUEUE:
+        write_queue = WriteQueue(db, max_batch=config.WRITE_BATCH_SIZE, max_delay=config.WRITE_BATCH_DELAY)
+    model = BookingModel(db, kdf_params=config.KDF_PARAMS, venue_capacity=config.VENUE_CAPACITY,
+                         write_queue=write_queue, catalog_check_interval=None)
+    app.state.model = AsyncBookingModel(model, max_workers=config.DB_WORKERS, kdf_workers=config.KDF_WORKERS)
+    app.state.tokens = TokenManager(load_secret(config.SECRET_KEY_FILE, config.SECRET_KEY), ttl=config.TOKEN_TTL)
+    await refresh_shared_state(app)
+    refresher = asyncio.create_task(refresh_shared_state_forever(app, config.CACHE_CHECK_INTERVAL))
+    app.state.events = EventBroker(app.state.model, poll_interval=config.EVENT_POLL_INTERVAL,
+                                   retention=config.EVENT_RETENTION)
+    await app.state.events.start()
+    try:
+        yield
+    finally:
+        await app.state.events.close()
+        refresher.cancel()
+        try:
+            await refresher
+        except asyncio.CancelledError:
+            pass
+        app.state.model.close()
+        if write_queue is not None:
+            write_queue.close()
+        db.close()
+
+
+metrics = Metrics()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware, minimum_size=config.COMPRESSION_MIN_SIZE)
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+if config.SQL_TRACE:
+    app.add_middleware(QueryTraceMiddleware)
 
 # Define the OAuth2 scheme with the token URL pointing to the login endpoint
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
-    db = Database()
-    model = BookingModel(db)
-    with model.db.get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT role FROM users WHERE username = ?", (token,))
-        result = cursor.fetchone()
-        if not result:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return result[0]
+def get_model(request: Request):
+    return request.app.state.model
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)):
+    try:
+        _, role = request.app.state.tokens.verify(token)
+    except TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+    return role
+
+def booking_filters(date_from: Optional[str] = None, date_to: Optional[str] = None, completed: Optional[bool] = None,
+                    event_type: Optional[str] = None, program_id: Optional[int] = None):
+    return {"date_from": date_from, "date_to": date_to, "completed": completed,
+            "event_type": event_type, "program_id": program_id}
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor, key_type=str):
+    # Курсор - ключ последней строки страницы: (date, id) для списка, (rank, id) для поиска
+    try:
+        key, booking_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return key_type(key), int(booking_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.post("/register/")
-async def register_user(user: UserCreate):
-    db = Database()
-    model = BookingModel(db)
-    if model.create_user(user.username, user.password, user.role):
+async def register_user(user: UserCreate, model: AsyncBookingModel = Depends(get_model)):
+    if await model.create_user(user.username, user.password, user.role):
         return {"message": "User registered successfully"}
     raise HTTPException(status_code=400, detail="Username already exists")
 
 @app.post("/login/")
-async def login_user(user: UserCreate):
-    db = Database()
-    model = BookingModel(db)
-    role = model.authenticate_user(user.username, user.password)
+async def login_user(user: UserCreate, request: Request, model: AsyncBookingModel = Depends(get_model)):
+    role = await model.authenticate_user(user.username, user.password)
     if role:
-        return {"access_token": user.username, "token_type": "bearer", "role": role}
+        token = request.app.state.tokens.issue(user.username, role)
+        return {"access_token": token, "token_type": "bearer", "role": role}
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
+@app.delete("/users/{username}")
+async def delete_user(username: str, request: Request, current_user: str = Depends(get_current_user),
+                      model: AsyncBookingModel = Depends(get_model)):
+    if current_user != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if not await model.delete_user(username):
+        raise HTTPException(status_code=404, detail="User not found")
+    request.app.state.tokens.revoke_user(username)
+    return {"message": "User deleted"}
+
+def quote_booking(catalog, booking):
+    return catalog.pricing.quote(booking.program_id, booking.addon_ids, booking.masterclass_ids, booking.guest_count)
+
+@app.post("/quote")
+async def quote(configurations: Union[QuoteRequest, list[QuoteRequest]], current_user: str = Depends(get_current_user),
+                model: AsyncBookingModel = Depends(get_model)):
+    catalog = await model.get_catalog()
+    single = isinstance(configurations, QuoteRequest)
+    batch = [configurations] if single else configurations
+    results = catalog.pricing.quote_many(
+        [(c.program_id, c.addon_ids, c.masterclass_ids, c.guest_count) for c in batch]
+    )
+    quotes = []
+    for result in results:
+        if isinstance(result, PriceError):
+            if single:
+                raise HTTPException(status_code=400, detail=str(result))
+            quotes.append({"error": str(result)})
+        else:
+            program_price, addons_price, masterclasses_price = result
+            quotes.append({"program_price": program_price, "addons_price": addons_price,
+                           "masterclasses_price": masterclasses_price,
+                           "total_price": program_price + addons_price + masterclasses_price})
+    return quotes[0] if single else quotes
+
 @app.post("/bookings/")
-async def create_booking(booking: BookingCreate, current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def create_booking(booking: BookingCreate, request: Request, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
     # Обычные пользователи могут создавать бронирования
-    total_price = 0
-    program = next((p for p in model.get_programs() if p["id"] == booking.program_id), None)
-    if not program:
-        raise HTTPException(status_code=400, detail="Invalid program ID")
-    total_price += program["price"]
-
-    addons = model.get_addons()
-    addon_prices = {a["id"]: a["price"] for a in addons}
-    for addon_id in booking.addon_ids:
-        if addon_id not in addon_prices:
-            raise HTTPException(status_code=400, detail=f"Invalid addon ID: {addon_id}")
-        total_price += addon_prices[addon_id]
-
-    masterclasses = model.get_masterclasses()
-    masterclass_prices = {m["id"]: m["price_per_child"] for m in masterclasses}
-    for masterclass_id in booking.masterclass_ids:
-        if masterclass_id not in masterclass_prices:
-            raise HTTPException(status_code=400, detail=f"Invalid masterclass ID: {masterclass_id}")
-        total_price += masterclass_prices[masterclass_id] * booking.guest_count
-
-    booking_id = model.create_booking(
-        booking.date, booking.event_type, booking.guest_count, booking.phone,
-        booking.child_name, booking.program_id, booking.addon_ids, booking.masterclass_ids, total_price
-    )
+    catalog = await model.get_catalog()
+    try:
+        total_price = quote_booking(catalog, booking)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        booking_id = await model.create_booking(
+            booking.date.isoformat(), booking.event_type, booking.guest_count, booking.phone,
+            booking.child_name, booking.program_id, booking.addon_ids, booking.masterclass_ids, total_price
+        )
+    except CapacityExceededError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    request.app.state.events.notify()
     return {"booking_id": booking_id, "total_price": total_price}
 
+@app.post("/bookings/bulk")
+async def create_bookings_bulk(request: Request, current_user: str = Depends(get_current_user),
+                               model: AsyncBookingModel = Depends(get_model)):
+    if current_user != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    body = await request.body()
+    # Принимаем JSON-массив или NDJSON (по одному заказу в строке)
+    if "ndjson" in request.headers.get("content-type", ""):
+        items = [line for line in body.splitlines() if line.strip()]
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of bookings")
+
+    catalog = await model.get_catalog()
+    rows = []
+    row_indexes = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            booking = BookingCreate.model_validate_json(item) if isinstance(item, bytes) else BookingCreate.model_validate(item)
+            total_price = quote_booking(catalog, booking)
+        except ValidationError as e:
+            errors.append({"index": index, "detail": e.errors(include_url=False, include_context=False)})
+            continue
+        except ValueError as e:
+            errors.append({"index": index, "detail": str(e)})
+            continue
+        rows.append((booking.date.isoformat(), booking.event_type, booking.guest_count, booking.phone, booking.child_name,
+                     booking.program_id, booking.addon_ids, booking.masterclass_ids, total_price))
+        row_indexes.append(index)
+
+    booking_ids = [None] * len(items)
+    created = 0
+    if rows:
+        for index, row, booking_id in zip(row_indexes, rows, await model.create_bookings(rows)):
+            if booking_id is None:
+                errors.append({"index": index, "detail": f"Not enough capacity on {row[0]}"})
+            else:
+                booking_ids[index] = booking_id
+                created += 1
+        errors.sort(key=lambda error: error["index"])
+        request.app.state.events.notify()
+    return {"created": created, "booking_ids": booking_ids, "errors": errors}
+
 @app.get("/bookings/")
-async def get_bookings(current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def get_bookings(request: Request, limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None,
+                       include_archived: bool = False, filters: dict = Depends(booking_filters),
+                       current_user: str = Depends(get_current_user),
+                       model: AsyncBookingModel = Depends(get_model)):
+    if current_user != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    # Номер последнего события до чтения: клиент продолжит поток /bookings/events с него, ничего не пропустив
+    last_event_id = request.app.state.events.last_id
+    after = decode_cursor(cursor) if cursor else None
+    bookings, next_key = await model.get_bookings(limit, after, include_archived, **filters)
+    total = await model.count_bookings(include_archived, **filters)
+    headers = {"X-Total-Count": str(total), "X-Last-Event-Id": str(last_event_id)}
+    if next_key:
+        headers["X-Next-Cursor"] = encode_cursor(next_key)
+    return FastJSONResponse(bookings, headers=headers)
+
+@app.get("/bookings/search")
+async def search_bookings(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(50, ge=1, le=500),
+                          cursor: Optional[str] = None, filters: dict = Depends(booking_filters),
+                          current_user: str = Depends(get_current_user), model: AsyncBookingModel = Depends(get_model)):
     if current_user != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    bookings = model.get_all_bookings()
-    for booking in bookings:
-        booking["addon_ids"] = json.loads(booking["addon_ids"])
-        booking["masterclass_ids"] = json.loads(booking["masterclass_ids"])
-    return bookings
+    after = decode_cursor(cursor, float) if cursor else None
+    bookings, next_key = await model.search_bookings(q, limit, after, **filters)
+    headers = {"X-Total-Count": str(await model.count_search_results(q, **filters))}
+    if next_key:
+        headers["X-Next-Cursor"] = encode_cursor(next_key)
+    return FastJSONResponse(bookings, headers=headers)
+
+@app.get("/bookings/changes")
+async def get_booking_changes(request: Request, since: int = Query(0, ge=0), instance: Optional[str] = None,
+                              limit: int = Query(1000, ge=1, le=5000), current_user: str = Depends(get_current_user),
+                              model: AsyncBookingModel = Depends(get_model)):
+    # Дельта-синхронизация: клиент хранит version и instance из ответа и в следующий раз передаёт их в since и instance
+    if current_user != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if since and instance is None:
+        raise HTTPException(status_code=400, detail="instance is required with since")
+    last_event_id = request.app.state.events.last_id
+    changes = await model.get_changes(since, limit, instance)
+    return FastJSONResponse(changes, headers={"X-Last-Event-Id": str(last_event_id)})
+
+@app.get("/bookings/events")
+async def booking_events(request: Request, last_event_id: Optional[int] = Query(None, ge=0),
+                         current_user: str = Depends(get_current_user)):
+    # Поток server-sent events: created, completed, deleted, imported, archived; reset - события потеряны, список нужно перечитать.
+    # Продолжение после обрыва - по заголовку Last-Event-ID (его шлёт EventSource) или параметру last_event_id
+    if current_user != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    header = request.headers.get("last-event-id", "")
+    if header.isdigit():
+        last_event_id = int(header)
+
+    async def stream():
+        # Подключение закрывается через EVENT_STREAM_MAX_AGE, чтобы открытые потоки не держали остановку сервера
+        # и не копились; клиент продолжает с последнего полученного события
+        yield "retry: 3000\n\n"
+        async for event in request.app.state.events.subscribe(last_event_id, config.EVENT_STREAM_MAX_AGE):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            event_id, kind, data = event
+            yield f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+EXPORT_COLUMNS = ["id", "date", "event_type", "guest_count", "phone", "child_name",
+                  "program", "addons", "masterclasses", "total_price", "completed"]
+EXPORT_CHUNK_ROWS = 500
+
+def export_rows(model, filters, include_archived=False):
+    catalog = model.get_catalog()
+    for booking in model.iter_bookings(include_archived=include_archived, **filters):
+        yield {
+            "id": booking["id"],
+            "date": booking["date"],
+            "event_type": booking["event_type"],
+            "guest_count": booking["guest_count"],
+            "phone": booking["phone"],
+            "child_name": booking["child_name"],
+            "program": catalog.program_names.get(booking["program_id"], booking["program_id"]),
+            "addons": [catalog.addon_names.get(i, i) for i in booking["addon_ids"]],
+            "masterclasses": [catalog.masterclass_names.get(i, i) for i in booking["masterclass_ids"]],
+            "total_price": booking["total_price"],
+            "completed": bool(booking["completed"]),
+        }
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, чтобы Excel открыл кириллицу в UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        row["addons"] = "; ".join(map(str, row["addons"]))
+        row["masterclasses"] = "; ".join(map(str, row["masterclasses"]))
+        writer.writerow([row[column] for column in EXPORT_COLUMNS])
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def stream_ndjson(rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+@app.get("/bookings/export")
+async def export_bookings(format: str = Query("csv", pattern="^(csv|ndjson)$"), include_archived: bool = True,
+                          filters: dict = Depends(booking_filters), current_user: str = Depends(get_current_user), model: AsyncBookingModel = Depends(get_model)):
+    # Выгрузка для учёта по умолчанию охватывает и архив; include_archived=false - только оперативные заказы
+    if current_user != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    rows = export_rows(model.model, filters, include_archived)
+    if format == "csv":
+        return StreamingResponse(stream_csv(rows), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=bookings.csv"})
+    return StreamingResponse(stream_ndjson(rows), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": "attachment; filename=bookings.ndjson"})
+
+@app.get("/customers/{phone}/bookings")
+async def get_customer_bookings(phone: str, include_archived: bool = False, current_user: str = Depends(get_current_user),
+                                model: AsyncBookingModel = Depends(get_model)):
+    if current_user != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    history = await model.get_customer_history(phone, include_archived)
+    if history is None:
+        raise HTTPException(status_code=400, detail="Invalid phone number")
+    return FastJSONResponse(history)
+
+@app.get("/availability")
+async def get_availability(date_from: datetime.date = Query(alias="from"),
+                           date_to: datetime.date = Query(alias="to"), current_user: str = Depends(get_current_user),
+                           model: AsyncBookingModel = Depends(get_model)):
+    if date_to < date_from or (date_to - date_from).days > 366:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    occupancy = await model.get_occupancy(date_from.isoformat(), date_to.isoformat())
+    capacity = model.venue_capacity
+    days = []
+    for offset in range((date_to - date_from).days + 1):
+        day = (date_from + datetime.timedelta(days=offset)).isoformat()
+        booked = occupancy.get(day, {"bookings": 0, "guests": 0})
+        days.append({
+            "date": day,
+            "bookings": booked["bookings"],
+            "guests": booked["guests"],
+            "capacity": capacity,
+            "remaining": None if capacity is None else max(capacity - booked["guests"], 0),
+        })
+    return days
+
+@app.get("/stats/revenue")
+async def get_revenue_stats(date_from: datetime.date = Query(alias="from"), date_to: datetime.date = Query(alias="to"),
+                            group: str = Query("day", pattern="^(day|month)$"), completed: Optional[bool] = None,
+                            current_user: str = Depends(get_current_user), model: AsyncBookingModel = Depends(get_model)):
+    if current_user != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return await model.get_revenue(date_from.isoformat(), date_to.isoformat(), group, completed)
+
+@app.get("/stats/items")
+async def get_item_stats(date_from: datetime.date = Query(alias="from"), date_to: datetime.date = Query(alias="to"),
+                         current_user: str = Depends(get_current_user), model: AsyncBookingModel = Depends(get_model)):
+    if current_user != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    catalog = await model.get_catalog()
+    names = {"addon": catalog.addon_names, "masterclass": catalog.masterclass_names}
+    items = await model.get_item_sales(date_from.isoformat(), date_to.isoformat())
+    for item in items:
+        item["name"] = names[item["item_type"]].get(item["item_id"])
+    return items
 
 @app.delete("/bookings/{booking_id}")
-async def delete_booking(booking_id: int, current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def delete_booking(booking_id: int, request: Request, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
     if current_user != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    model.delete_booking(booking_id)
+    await model.delete_booking(booking_id)
+    request.app.state.events.notify()
     return {"message": "Booking deleted"}
 
 @app.put("/bookings/{booking_id}/complete")
-async def mark_booking_completed(booking_id: int, current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def mark_booking_completed(booking_id: int, request: Request, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
     if current_user != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    model.mark_booking_completed(booking_id)
+    await model.mark_booking_completed(booking_id)
+    request.app.state.events.notify()
     return {"message": "Booking marked as completed"}
 
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+async def catalog_response(request, model, kind):
+    # Условный GET: если у клиента актуальная версия каталога, отвечаем 304 без обращения к базе и без тела
+    etag = model.model.catalog_etag()
+    if etag is not None and etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    catalog = await model.get_catalog()
+    items = [dict(item) for item in getattr(catalog, kind)]
+    return JSONResponse(items, headers={"ETag": catalog.etag, "Cache-Control": "no-cache"})
+
 @app.get("/programs/")
-async def get_programs(current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
-    return model.get_programs()
+async def get_programs(request: Request, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
+    return await catalog_response(request, model, "programs")
 
 @app.post("/programs/")
-async def add_program(program: ProgramCreate, current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def add_program(program: ProgramCreate, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
     if current_user != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    program_id = model.add_program(program.name, program.price)
+    program_id = await model.add_program(program.name, program.price)
     return {"program_id": program_id}
 
 @app.delete("/programs/{program_id}")
-async def delete_program(program_id: int, current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def delete_program(program_id: int, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
     if current_user != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    model.delete_program(program_id)
+    await model.delete_program(program_id)
     return {"message": "Program deleted"}
 
 @app.get("/addons/")
-async def get_addons(current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
-    return model.get_addons()
+async def get_addons(request: Request, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
+    return await catalog_response(request, model, "addons")
 
 @app.post("/addons/")
-async def add_addon(addon: AddonCreate, current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def add_addon(addon: AddonCreate, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
     if current_user != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    addon_id = model.add_addon(addon.name, addon.price)
+    addon_id = await model.add_addon(addon.name, addon.price)
     return {"addon_id": addon_id}
 
 @app.delete("/addons/{addon_id}")
-async def delete_addon(addon_id: int, current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def delete_addon(addon_id: int, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
     if current_user != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    model.delete_addon(addon_id)
+    await model.delete_addon(addon_id)
     return {"message": "Addon deleted"}
 
 @app.get("/masterclasses/")
-async def get_masterclasses(current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
-    return model.get_masterclasses()
+async def get_masterclasses(request: Request, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
+    return await catalog_response(request, model, "masterclasses")
 
 @app.post("/masterclasses/")
-async def add_masterclass(masterclass: MasterclassCreate, current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def add_masterclass(masterclass: MasterclassCreate, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
     if current_user != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    masterclass_id = model.add_masterclass(masterclass.name, masterclass.price_per_child)
+    masterclass_id = await model.add_masterclass(masterclass.name, masterclass.price_per_child)
     return {"masterclass_id": masterclass_id}
 
 @app.delete("/masterclasses/{masterclass_id}")
-async def delete_masterclass(masterclass_id: int, current_user: str = Depends(get_current_user)):
-    db = Database()
-    model = BookingModel(db)
+async def delete_masterclass(masterclass_id: int, current_user: str = Depends(get_current_user),
+                         model: AsyncBookingModel = Depends(get_model)):
     if current_user != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    model.delete_masterclass(masterclass_id)
-    return {"message": "Masterclass deleted"}
\ No newline at end of file
+    await model.delete_masterclass(masterclass_id)
+    return {"message": "Masterclass deleted"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request):
+    # Формат Prometheus; эндпоинт без авторизации, как принято для сбора метрик
+    cache = request.app.state.model.model.catalog_cache_info()
+    gauges = {"db_pool_connections": request.app.state.db.connection_count(), "catalog_cache_version": cache.version}
+    counters = {"catalog_cache_hits_total": cache.hits, "catalog_cache_misses_total": cache.misses}
+    write_queue = request.app.state.model.model.write_queue
+    if write_queue is not None:
+        counters["db_write_batches_total"] = write_queue.batches
+        counters["db_write_operations_total"] = write_queue.operations
+    return PlainTextResponse(metrics.render(gauges, counters), media_type="text/plain; version=0.0.4")
@@ -1,15 +1,23 @@
-from pydantic import BaseModel
+import datetime
+from pydantic import BaseModel, Field
 
+# Дата - только в виде ГГГГ-ММ-ДД, гостей - хотя бы один: иначе заказ обходит учёт занятости по дням
 class BookingCreate(BaseModel):
-    date: str
+    date: datetime.date
     event_type: str
-    guest_count: int
+    guest_count: int = Field(gt=0)
     phone: str
     child_name: str
     program_id: int
     addon_ids: list[int]
     masterclass_ids: list[int]
 
+class QuoteRequest(BaseModel):
+    program_id: int
+    addon_ids: list[int] = []
+    masterclass_ids: list[int] = []
+    guest_count: int = Field(gt=0)
+
 class ProgramCreate(BaseModel):
     name: str
     price: int
@@ -1,6 +1,31 @@
+import argparse
+import config
+from api.auth import load_secret
 from api.routers import app
+from db.database import Database
 
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description="Сервер API бронирований")
+    parser.add_argument("--host", default=config.HOST)
+    parser.add_argument("--port", type=int, default=config.PORT)
+    parser.add_argument("--workers", type=int, default=config.WORKERS,
+                        help="число процессов; каждый открывает свои соединения с общей базой SQLite")
+    args = parser.parse_args()
+
     import uvicorn
-    uvicorn.run(app, host="localhost", port=8000, log_level="info")
\ No newline at end of file
+    if args.workers > 1:
+        # Миграции и файл секрета готовятся до запуска воркеров, чтобы они не делали это наперегонки
+        Database(config.DB_NAME).close()
+        load_secret(config.SECRET_KEY_FILE, config.SECRET_KEY)
+        # Воркеры импортируют приложение сами, поэтому оно передаётся строкой
+        uvicorn.run("api.routers:app", host=args.host, port=args.port, workers=args.workers, log_level="info",
+                    timeout_graceful_shutdown=config.SHUTDOWN_TIMEOUT)
+    else:
+        # Открытые потоки /bookings/events прерываются по таймауту, иначе остановка ждала бы их бесконечно
+        uvicorn.run(app, host=args.host, port=args.port, log_level="info",
+                    timeout_graceful_shutdown=config.SHUTDOWN_TIMEOUT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+from contextlib import asynccontextmanager
+
+
+def use_temp_database(prefix="bench-"):
+    # Вызывать до импорта api.routers: config читает путь к базе при импорте
+    directory = tempfile.mkdtemp(prefix=prefix)
+    path = os.path.join(directory, "events.db")
+    os.environ["EVENTS_DB"] = path
+    os.environ.setdefault("EVENTS_SECRET_KEY", "benchmark-secret")
+    return path
+
+
+@asynccontextmanager
+async def app_client():
+    import httpx
+    from api.routers import app
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            yield client
+
+
+async def login(client, username="admin", password="admin123"):
+    response = await client.post("/login/", json={"username": username, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3) if samples else None,
+        "p95_ms": round(percentile(samples, 95) * 1000, 3) if samples else None,
+        "p99_ms": round(percentile(samples, 99) * 1000, 3) if samples else None,
+    }
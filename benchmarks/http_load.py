@@ -0,0 +1,183 @@
+"""Нагрузочный тест API в процессе: заполняет временную базу и гоняет смесь запросов через ASGI-клиент.
+
+    python -m benchmarks.http_load --bookings 10000 --requests 5000 --concurrency 32 --output result.json
+
+Результат - JSON с пропускной способностью и p50/p95/p99 по каждому маршруту,
+пригодный для сравнения между коммитами.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import time
+
+from benchmarks.common import app_client, latency_summary, login, use_temp_database
+
+FIRST_DATE = datetime.date(2025, 1, 1)
+DATE_SPAN_DAYS = 3 * 365
+
+DEFAULT_MIX = {
+    "login": 1,
+    "programs": 10,
+    "addons": 5,
+    "masterclasses": 5,
+    "quote": 5,
+    "availability": 3,
+    "create_booking": 8,
+    "bulk_import": 1,
+    "admin_listing": 4,
+    "admin_listing_filtered": 2,
+    "export": 1,
+    "stats_revenue": 1,
+    "stats_items": 1,
+    "complete_booking": 2,
+    "delete_booking": 1,
+    "catalog_write": 1,
+}
+
+
+def random_booking(rng):
+    return {
+        "date": (FIRST_DATE + datetime.timedelta(days=rng.randrange(DATE_SPAN_DAYS))).isoformat(),
+        "event_type": rng.choice(["День рождения", "Мастер-класс"]),
+        "guest_count": rng.randint(3, 20),
+        "phone": f"+7 9{rng.randrange(10 ** 9):09d}",
+        "child_name": rng.choice(["Маша", "Петя", "Аня", "Ваня", "Соня"]),
+        "program_id": rng.randint(1, 4),
+        "addon_ids": rng.sample([1, 2, 3], rng.randint(0, 2)),
+        "masterclass_ids": rng.sample([1, 2, 3], rng.randint(0, 2)),
+    }
+
+
+def seed(path, count, rng, batch_size=10000):
+    from db.database import Database
+    from db.models import BookingModel
+    db = Database(path)
+    model = BookingModel(db)
+    pricing = model.get_catalog().pricing
+    for start in range(0, count, batch_size):
+        rows = []
+        for _ in range(min(batch_size, count - start)):
+            b = random_booking(rng)
+            total = pricing.quote(b["program_id"], b["addon_ids"], b["masterclass_ids"], b["guest_count"])
+            rows.append((b["date"], b["event_type"], b["guest_count"], b["phone"], b["child_name"],
+                         b["program_id"], b["addon_ids"], b["masterclass_ids"], total))
+        model.create_bookings(rows)
+    db.close()
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown route: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    async with app_client() as client:
+        admin = await login(client)
+        await client.post("/register/", json={"username": "bench", "password": "bench"})
+        user = await login(client, "bench", "bench")
+
+        def some_date():
+            return (FIRST_DATE + datetime.timedelta(days=rng.randrange(DATE_SPAN_DAYS))).isoformat()
+
+        def some_booking_id():
+            return rng.randint(1, max(args.bookings, 1))
+
+        operations = {
+            "login": lambda: client.post("/login/", json={"username": "bench", "password": "bench"}),
+            "programs": lambda: client.get("/programs/", headers=user),
+            "addons": lambda: client.get("/addons/", headers=user),
+            "masterclasses": lambda: client.get("/masterclasses/", headers=user),
+            "quote": lambda: client.post("/quote", headers=user, json=[
+                {"program_id": rng.randint(1, 4), "addon_ids": [1], "masterclass_ids": [2], "guest_count": 10}
+                for _ in range(10)]),
+            "availability": lambda: client.get("/availability", headers=user,
+                                               params={"from": FIRST_DATE.isoformat(), "to": "2025-01-31"}),
+            "create_booking": lambda: client.post("/bookings/", headers=user, json=random_booking(rng)),
+            "bulk_import": lambda: client.post("/bookings/bulk", headers=admin,
+                                               json=[random_booking(rng) for _ in range(100)]),
+            "admin_listing": lambda: client.get("/bookings/", headers=admin, params={"limit": 100}),
+            "admin_listing_filtered": lambda: client.get("/bookings/", headers=admin, params={
+                "limit": 100, "date_from": some_date(), "completed": False, "program_id": rng.randint(1, 4)}),
+            "export": lambda: client.get("/bookings/export", headers=admin, params={
+                "format": "ndjson", "date_from": "2025-01-01", "date_to": "2025-01-07"}),
+            "stats_revenue": lambda: client.get("/stats/revenue", headers=admin,
+                                                params={"from": "2025-01-01", "to": "2027-12-31", "group": "month"}),
+            "stats_items": lambda: client.get("/stats/items", headers=admin,
+                                              params={"from": "2025-01-01", "to": "2027-12-31"}),
+            "complete_booking": lambda: client.put(f"/bookings/{some_booking_id()}/complete", headers=admin),
+            "delete_booking": lambda: client.delete(f"/bookings/{some_booking_id()}", headers=admin),
+            "catalog_write": lambda: client.post("/addons/", headers=admin, json={"name": "Bench", "price": 100}),
+        }
+        names = list(args.mix)
+        weights = [args.mix[name] for name in names]
+        latencies = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+        remaining = args.requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                name = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                response = await operations[name]()
+                latencies[name].append(time.perf_counter() - start)
+                if response.status_code >= 500 or response.status_code in (401, 403, 422):
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "config": {"bookings": args.bookings, "requests": args.requests, "concurrency": args.concurrency,
+                   "mix": args.mix, "seed": args.seed},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 1),
+        "routes": {
+            name: {**latency_summary(latencies[name]), "errors": errors[name],
+                   "throughput_rps": round(len(latencies[name]) / elapsed, 1)}
+            for name in names
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=10000, help="сколько заказов создать в базе перед тестом")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="веса маршрутов, например programs=10,create_booking=2")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда записать JSON с результатом (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    path = use_temp_database()
+    # Тест проверяет скорость, а не ограничения площадки и стоимость хеширования паролей
+    os.environ.setdefault("EVENTS_VENUE_CAPACITY", str(10 ** 9))
+    os.environ.setdefault("EVENTS_KDF_N", str(2 ** 12))
+    seed_started = time.perf_counter()
+    seed(path, args.bookings, random.Random(args.seed))
+    seed_elapsed = time.perf_counter() - seed_started
+    result = asyncio.run(run(args))
+    result["seed_s"] = round(seed_elapsed, 3)
+    report = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Пропускная способность входа и задержка остальных запросов во время волны входов.
+
+    python -m benchmarks.login_storm --duration 10 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import app_client, latency_summary, login, use_temp_database
+
+
+async def run(duration, concurrency, users):
+    async with app_client() as client:
+        headers = await login(client)
+        for i in range(users):
+            response = await client.post("/register/", json={"username": f"user{i}", "password": f"password{i}"})
+            response.raise_for_status()
+
+        deadline = time.perf_counter() + duration
+        login_latencies = []
+        probe_latencies = []
+
+        async def login_worker(worker):
+            i = worker
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.post("/login/", json={"username": f"user{i % users}", "password": f"password{i % users}"})
+                response.raise_for_status()
+                login_latencies.append(time.perf_counter() - start)
+                i += concurrency
+
+        async def probe():
+            # Лёгкий запрос, который не должен страдать от хеширования паролей
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get("/programs/", headers=headers)
+                response.raise_for_status()
+                probe_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        started = time.perf_counter()
+        await asyncio.gather(probe(), *(login_worker(w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        return {
+            "duration_s": round(elapsed, 3),
+            "concurrency": concurrency,
+            "logins_per_s": round(len(login_latencies) / elapsed, 1),
+            "login": latency_summary(login_latencies),
+            "programs_during_storm": latency_summary(probe_latencies),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+    use_temp_database()
+    print(json.dumps(asyncio.run(run(args.duration, args.concurrency, args.users)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Нагрузка на POST /bookings/ через настоящий сервер с несколькими воркерами и проверка базы после неё.
+
+    python -m benchmarks.multiworker_stress --workers 4 --requests 4000 --concurrency 64
+
+Сервер (app.py) запускается отдельным процессом на временной базе. Проверяется, что:
+- каждый принятый заказ есть в базе, и в базе нет лишних;
+- вместимость площадки не превышена ни в один день, а daily_occupancy совпадает с заказами;
+- клиенты не получили ни 5xx, ни ошибок блокировки SQLite;
+- новая программа и отзыв токена удалённого пользователя видны всем воркерам через интервал проверки кешей.
+Код возврата 1, если хоть одна проверка не прошла.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from benchmarks.common import latency_summary, use_temp_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_CHECK_INTERVAL = 0.5
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(base_url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                response = await client.post("/login/", json={"username": "admin", "password": "admin123"})
+                if response.status_code == 200:
+                    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+async def hammer(base_url, headers, requests, concurrency, days):
+    statuses = Counter()
+    lock_errors = []
+    booking_ids = []
+    latencies = []
+    pending = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60.0) as client:
+        async def worker():
+            for i in pending:
+                booking = {"date": f"2026-09-{i % days + 1:02d}", "event_type": "День рождения", "guest_count": 3,
+                           "phone": f"+7 900 {i:07d}", "child_name": f"Гость {i}", "program_id": 1,
+                           "addon_ids": [1], "masterclass_ids": []}
+                start = time.perf_counter()
+                response = await client.post("/bookings/", json=booking)
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    booking_ids.append(response.json()["booking_id"])
+                elif response.status_code >= 500 or "locked" in response.text or "busy" in response.text:
+                    lock_errors.append(response.text[:200])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return elapsed, statuses, lock_errors, booking_ids, latencies
+
+
+async def check_coherence(base_url, headers, probes):
+    # Каталог и отзыв токенов меняются через один воркер, а проверяются запросами, разошедшимися по всем
+    async with httpx.AsyncClient(base_url=base_url, headers=headers) as client:
+        response = await client.post("/programs/", json={"name": "Новая программа", "price": 9000})
+        program_id = response.json()["program_id"]
+        await client.post("/register/", json={"username": "leaver", "password": "leaver-password"})
+        response = await client.post("/login/", json={"username": "leaver", "password": "leaver-password"})
+        leaver_token = response.json()["access_token"]
+        await client.delete("/users/leaver")
+    await asyncio.sleep(CACHE_CHECK_INTERVAL * 2)
+
+    async def probe(_):
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            quote = await client.post("/quote", headers=headers, json={"program_id": program_id, "guest_count": 5})
+            revoked = await client.get("/programs/", headers={"Authorization": f"Bearer {leaver_token}"})
+            return quote.status_code, revoked.status_code
+
+    results = await asyncio.gather(*(probe(i) for i in range(probes)))
+    return {
+        "stale_catalog": sum(1 for quote, _ in results if quote != 200),
+        "revoked_token_accepted": sum(1 for _, revoked in results if revoked != 401),
+    }
+
+
+def check_database(path, booking_ids, capacity):
+    conn = sqlite3.connect(path)
+    try:
+        stored = {row[0] for row in conn.execute("SELECT id FROM bookings")}
+        over_capacity = conn.execute(
+            "SELECT COUNT(*) FROM (SELECT date FROM bookings GROUP BY date HAVING SUM(guest_count) > ?)", (capacity,)
+        ).fetchone()[0]
+        occupancy_mismatch = conn.execute("""
+            SELECT COUNT(*) FROM (SELECT date, COUNT(*) AS bookings, SUM(guest_count) AS guests FROM bookings GROUP BY date) b
+            LEFT JOIN daily_occupancy o ON o.date = b.date
+            WHERE o.bookings IS NOT b.bookings OR o.guests IS NOT b.guests
+        """).fetchone()[0]
+    finally:
+        conn.close()
+    accepted = set(booking_ids)
+    return {
+        "stored_bookings": len(stored),
+        "duplicate_ids": len(booking_ids) - len(accepted),
+        "lost_bookings": len(accepted - stored),
+        "unexpected_bookings": len(stored - accepted),
+        "days_over_capacity": over_capacity,
+        "occupancy_mismatch": occupancy_mismatch,
+    }
+
+
+async def run(args, base_url, path):
+    headers = await wait_ready(base_url)
+    elapsed, statuses, lock_errors, booking_ids, latencies = await hammer(
+        base_url, headers, args.requests, args.concurrency, args.days)
+    coherence = await check_coherence(base_url, headers, args.probes)
+    return {
+        "workers": args.workers,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 3),
+        "requests_per_s": round(args.requests / elapsed, 1),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "lock_errors": len(lock_errors),
+        "lock_error_samples": lock_errors[:5],
+        "create_booking": latency_summary(latencies),
+        "coherence": coherence,
+    }, booking_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--days", type=int, default=30, help="на сколько дней распределяются заказы")
+    parser.add_argument("--capacity", type=int, default=300, help="вместимость площадки в день")
+    parser.add_argument("--probes", type=int, default=50)
+    args = parser.parse_args()
+
+    path = use_temp_database(prefix="multiworker-")
+    port = free_port()
+    env = dict(os.environ, EVENTS_VENUE_CAPACITY=str(args.capacity), EVENTS_CACHE_CHECK_INTERVAL=str(CACHE_CHECK_INTERVAL),
+               EVENTS_KDF_N=str(2 ** 12))
+    server = subprocess.Popen([sys.executable, "app.py", "--host", "127.0.0.1", "--port", str(port),
+                               "--workers", str(args.workers)], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        report, booking_ids = asyncio.run(run(args, f"http://127.0.0.1:{port}", path))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    report["database"] = check_database(path, booking_ids, args.capacity)
+    database, coherence = report["database"], report["coherence"]
+    report["ok"] = (report["lock_errors"] == 0 and database["lost_bookings"] == 0 and database["duplicate_ids"] == 0
+                    and database["unexpected_bookings"] == 0 and database["days_over_capacity"] == 0
+                    and database["occupancy_mismatch"] == 0 and coherence["stale_catalog"] == 0
+                    and coherence["revoked_token_accepted"] == 0)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
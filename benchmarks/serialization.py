@@ -0,0 +1,73 @@
+"""Время сериализации и размер ответа списка заказов: стандартный путь FastAPI против FastJSONResponse и сжатия.
+
+    python -m benchmarks.serialization --sizes 10000 100000
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from api import responses
+from api.responses import FastJSONResponse
+
+
+def make_bookings(count, rng):
+    return [{
+        "id": i,
+        "date": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "event_type": rng.choice(["День рождения", "Мастер-класс"]),
+        "guest_count": rng.randint(3, 20),
+        "phone": f"+7 9{rng.randrange(10 ** 9):09d}",
+        "child_name": rng.choice(["Маша", "Петя", "Аня", "Ваня", "Соня"]),
+        "program_id": rng.randint(1, 4),
+        "addon_ids": rng.sample([1, 2, 3], rng.randint(0, 2)),
+        "masterclass_ids": rng.sample([1, 2, 3], rng.randint(0, 2)),
+        "total_price": rng.randint(8000, 20000),
+        "completed": rng.randint(0, 1),
+    } for i in range(1, count + 1)]
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, round(best * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {"orjson": responses.orjson is not None, "brotli": responses.brotli is not None, "sizes": {}}
+    for size in args.sizes:
+        bookings = make_bookings(size, random.Random(size))
+        default_body, default_ms = timed(lambda: JSONResponse(jsonable_encoder(bookings)).body, args.repeat)
+        fast_body, fast_ms = timed(lambda: FastJSONResponse(bookings).body, args.repeat)
+        gzip_body, gzip_ms = timed(lambda: gzip.compress(fast_body, compresslevel=6), args.repeat)
+        result = {
+            "default_serialize_ms": default_ms,
+            "fast_serialize_ms": fast_ms,
+            "bytes_default": len(default_body),
+            "bytes_fast": len(fast_body),
+            "bytes_gzip": len(gzip_body),
+            "gzip_ms": gzip_ms,
+        }
+        if responses.brotli is not None:
+            br_body, br_ms = timed(lambda: responses.brotli.compress(fast_body, quality=4), args.repeat)
+            result.update({"bytes_br": len(br_body), "br_ms": br_ms})
+        assert json.loads(fast_body) == json.loads(default_body)
+        results["sizes"][size] = result
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Волна одновременных заказов: отдельная транзакция на заказ против очереди групповой фиксации.
+
+    python -m benchmarks.write_burst --bookings 5000 --concurrency 64
+
+Для каждого режима выводится число заказов и транзакций в секунду, задержка create_booking и число ошибок.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import config
+from benchmarks.common import latency_summary, use_temp_database
+from db.database import Database
+from db.models import AsyncBookingModel, BookingModel
+from db.writer import WriteQueue
+
+
+async def burst(model, bookings, concurrency):
+    latencies = []
+    errors = {}
+    pending = iter(range(bookings))
+
+    async def writer():
+        for i in pending:
+            start = time.perf_counter()
+            try:
+                await model.create_booking(f"2026-{i % 12 + 1:02d}-{i % 28 + 1:02d}", "День рождения", 5,
+                                           f"+7 900 {i:07d}", f"Гость {i}", 1, [1], [2], 12000)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+async def run_mode(queued, bookings, concurrency, batch_size, delay_ms):
+    path = use_temp_database(prefix="write-burst-")
+    db = Database(path)
+    write_queue = WriteQueue(db, max_batch=batch_size, max_delay=delay_ms / 1000) if queued else None
+    model = AsyncBookingModel(BookingModel(db, write_queue=write_queue), max_workers=config.DB_WORKERS)
+    try:
+        elapsed, latencies, errors = await burst(model, bookings, concurrency)
+    finally:
+        model.close()
+        if write_queue is not None:
+            write_queue.close()
+        db.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    commits = write_queue.batches if queued else len(latencies) - sum(errors.values())
+    return {
+        "duration_s": round(elapsed, 3),
+        "bookings_per_s": round(len(latencies) / elapsed, 1),
+        "commits": commits,
+        "commits_per_s": round(commits / elapsed, 1),
+        "errors": errors,
+        "create_booking": latency_summary(latencies),
+    }
+
+
+async def run(bookings, concurrency, batch_size, delay_ms):
+    return {
+        "bookings": bookings,
+        "concurrency": concurrency,
+        "per_transaction": await run_mode(False, bookings, concurrency, batch_size, delay_ms),
+        "write_queue": await run_mode(True, bookings, concurrency, batch_size, delay_ms),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--delay-ms", type=float, default=2.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.bookings, args.concurrency, args.batch_size, args.delay_ms)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
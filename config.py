@@ -0,0 +1,54 @@
+import os
+
+# Путь к файлу базы данных SQLite
+DB_NAME = os.environ.get("EVENTS_DB", "events.db")
+
+# Число потоков, выполняющих запросы к базе для асинхронных обработчиков API
+DB_WORKERS = int(os.environ.get("EVENTS_DB_WORKERS", "4"))
+
+# Секрет для подписи токенов: переменная окружения или файл, создаваемый при первом запуске
+SECRET_KEY = os.environ.get("EVENTS_SECRET_KEY")
+SECRET_KEY_FILE = os.environ.get("EVENTS_SECRET_KEY_FILE", "secret.key")
+# Время жизни токена доступа в секундах
+TOKEN_TTL = int(os.environ.get("EVENTS_TOKEN_TTL", str(8 * 3600)))
+
+# Параметры scrypt для хеширования паролей и размер пула потоков для него
+KDF_PARAMS = {
+    "n": int(os.environ.get("EVENTS_KDF_N", str(2 ** 14))),
+    "r": int(os.environ.get("EVENTS_KDF_R", "8")),
+    "p": int(os.environ.get("EVENTS_KDF_P", "1")),
+}
+KDF_WORKERS = int(os.environ.get("EVENTS_KDF_WORKERS", "2"))
+
+# Вместимость площадки: сколько гостей можно принять за один день
+VENUE_CAPACITY = int(os.environ.get("EVENTS_VENUE_CAPACITY", "100"))
+
+# Трассировка SQL-запросов: заголовки X-DB-Queries/X-DB-Time и отладочный лог db.trace
+SQL_TRACE = os.environ.get("EVENTS_SQL_TRACE", "") not in ("", "0", "false")
+
+# Ответы меньше этого размера (в байтах) не сжимаются
+COMPRESSION_MIN_SIZE = int(os.environ.get("EVENTS_COMPRESSION_MIN_SIZE", "1024"))
+
+# Групповая фиксация записей: операции, пришедшие в пределах окна, фиксируются одной транзакцией
+WRITE_QUEUE = os.environ.get("EVENTS_WRITE_QUEUE", "1") not in ("", "0", "false")
+WRITE_BATCH_SIZE = int(os.environ.get("EVENTS_WRITE_BATCH_SIZE", "64"))
+WRITE_BATCH_DELAY = float(os.environ.get("EVENTS_WRITE_BATCH_DELAY_MS", "2")) / 1000
+
+# Адрес и число процессов сервера API (python app.py); параметры командной строки важнее
+HOST = os.environ.get("EVENTS_HOST", "localhost")
+PORT = int(os.environ.get("EVENTS_PORT", "8000"))
+WORKERS = int(os.environ.get("EVENTS_WORKERS", "1"))
+# Как часто (в секундах) процесс проверяет версию каталога и отзывы токенов, изменённые другими процессами
+CACHE_CHECK_INTERVAL = float(os.environ.get("EVENTS_CACHE_CHECK_INTERVAL", "1.0"))
+
+# Поток событий /bookings/events: как часто читать журнал событий других процессов и сколько его хранить
+EVENT_POLL_INTERVAL = float(os.environ.get("EVENTS_EVENT_POLL_INTERVAL", "0.5"))
+EVENT_RETENTION = int(os.environ.get("EVENTS_EVENT_RETENTION_HOURS", "24")) * 3600
+# Сколько секунд живёт одно подключение к потоку: затем клиент переподключается с Last-Event-ID
+EVENT_STREAM_MAX_AGE = int(os.environ.get("EVENTS_EVENT_STREAM_MAX_AGE", "300"))
+# Сколько секунд сервер при остановке ждёт завершения открытых запросов, прежде чем прервать их
+SHUTDOWN_TIMEOUT = int(os.environ.get("EVENTS_SHUTDOWN_TIMEOUT", "5"))
+
+# Архивация (python manage.py archive): завершённые заказы старше стольких дней переносятся в архив порциями
+ARCHIVE_AFTER_DAYS = int(os.environ.get("EVENTS_ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("EVENTS_ARCHIVE_BATCH_SIZE", "1000"))
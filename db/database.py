@@ -1,116 +1,819 @@
+import random
 import sqlite3
-from contextlib import contextmanager
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from db import tracing
+from db.phones import normalize_phone
 import hashlib
+import json
+
+
+class _ObservedConnection(sqlite3.Connection):
+    # Сообщает получателю метрик о каждой завершённой транзакции; commit() без открытой транзакции не считается
+    listener = None
+
+    def commit(self):
+        active = self.in_transaction
+        super().commit()
+        if active and self.listener is not None:
+            self.listener.transaction_finished("commit")
+
+    def rollback(self):
+        active = self.in_transaction
+        super().rollback()
+        if active and self.listener is not None:
+            self.listener.transaction_finished("rollback")
 
 
 class Database:
-    def __init__(self, db_name="events.db"):
+    def __init__(self, db_name="events.db", timeout=5.0, cached_statements=256, health_check_interval=30.0,
+                 listener=None):
         self.db_name = db_name
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.health_check_interval = health_check_interval
+        # Необязательный получатель метрик: connection_opened(), connection_block(duration)
+        # и transaction_finished(outcome) с outcome "commit" или "rollback"
+        self.listener = listener
+        # Пул соединений: одно долгоживущее соединение на поток
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._generation = 0
         self._initialized = False
         self.init_db()
 
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, timeout=self.timeout, cached_statements=self.cached_statements,
+                               check_same_thread=False, factory=_ObservedConnection)
+        conn.listener = self.listener
+        conn.row_factory = sqlite3.Row
+        # Переход в WAL требует блокировки; при одновременном старте нескольких процессов она может быть занята
+        retry_on_busy(lambda: conn.execute("PRAGMA journal_mode=WAL"))
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        if self.listener is not None:
+            self.listener.connection_opened()
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _acquire(self):
+        local = self._local
+        conn = getattr(local, "conn", None)
+        now = time.monotonic()
+        if conn is not None and local.generation != self._generation:
+            conn = None
+        elif conn is not None and now - local.checked_at > self.health_check_interval:
+            if not self._is_healthy(conn):
+                self._discard(conn)
+                conn = None
+            local.checked_at = now
+        if conn is None:
+            conn = self._connect()
+            thread = threading.current_thread()
+            with self._lock:
+                # Закрываем соединения завершившихся потоков
+                for ident, (owner, stale) in list(self._connections.items()):
+                    if not owner.is_alive():
+                        stale.close()
+                        del self._connections[ident]
+                self._connections[thread.ident] = (thread, conn)
+                local.generation = self._generation
+            local.conn = conn
+            local.checked_at = now
+            local.depth = 0
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            for ident, (_, owned) in list(self._connections.items()):
+                if owned is conn:
+                    del self._connections[ident]
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._local.conn = None
+
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row
+        conn = self._acquire()
+        local = self._local
+        local.depth += 1
+        started = time.perf_counter()
+        try:
+            with tracing.attach(conn) if local.depth == 1 else nullcontext():
+                yield conn
+                # Фиксируем транзакцию только во внешнем блоке
+                if local.depth == 1:
+                    conn.commit()
+        except BaseException:
+            if local.depth == 1 and conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            local.depth -= 1
+            if local.depth == 0 and self.listener is not None:
+                self.listener.connection_block(time.perf_counter() - started)
+
+    @contextmanager
+    def reader(self):
+        # Отдельное соединение для длинных потоковых чтений, не занимающее соединение потока
+        conn = self._connect()
+        started = time.perf_counter()
         try:
-            yield conn
-            conn.commit()
+            with tracing.attach(conn):
+                yield conn
         finally:
             conn.close()
+            if self.listener is not None:
+                self.listener.connection_block(time.perf_counter() - started)
+
+    def connection_count(self):
+        with self._lock:
+            return len(self._connections)
+
+    def ping(self):
+        with self.get_connection() as conn:
+            return self._is_healthy(conn)
+
+    def close(self):
+        with self._lock:
+            connections = [conn for _, conn in self._connections.values()]
+            self._connections.clear()
+            self._generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
 
     def init_db(self):
         if self._initialized:
             return
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            # Programs table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS programs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    price INTEGER NOT NULL
-                )
-            """)
-            # Add-ons table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS addons (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    price INTEGER NOT NULL
-                )
-            """)
-            # Masterclasses table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS masterclasses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    price_per_child INTEGER NOT NULL
-                )
+            migrate(conn)
+        self._initialized = True
+
+    def schema_version(self):
+        with self.get_connection() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _migration_initial_schema(cursor):
+    # Programs table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS programs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL
+        )
+    """)
+    # Add-ons table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS addons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL
+        )
+    """)
+    # Masterclasses table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS masterclasses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price_per_child INTEGER NOT NULL
+        )
+    """)
+    # Bookings table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            guest_count INTEGER NOT NULL,
+            phone TEXT NOT NULL,
+            child_name TEXT NOT NULL,
+            program_id INTEGER,
+            addon_ids TEXT,
+            masterclass_ids TEXT,
+            total_price INTEGER NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (program_id) REFERENCES programs(id)
+        )
+    """)
+    # Users table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('admin', 'user'))
+        )
+    """)
+    # Старые базы без колонки completed
+    cursor.execute("PRAGMA table_info(bookings)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if "completed" not in columns:
+        cursor.execute("ALTER TABLE bookings ADD COLUMN completed INTEGER NOT NULL DEFAULT 0")
+    # Check if default admin exists
+    cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
+    if cursor.fetchone()[0] == 0:
+        # Default admin: username='admin', password='admin123'
+        cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                      ("admin", hashlib.sha256("admin123".encode()).hexdigest(), "admin"))
+    # Insert default data for programs
+    cursor.execute("SELECT COUNT(*) FROM programs")
+    if cursor.fetchone()[0] == 0:
+        programs = [
+            ("Transformers", 8000),
+            ("Lady Bug", 8000),
+            ("Disney", 8000),
+            ("Super Heroes", 8000)
+        ]
+        cursor.executemany("INSERT INTO programs (name, price) VALUES (?, ?)", programs)
+    # Insert default data for addons
+    cursor.execute("SELECT COUNT(*) FROM addons")
+    if cursor.fetchone()[0] == 0:
+        addons = [
+            ("Soap Show", 2000),
+            ("Magic Disco", 2000),
+            ("Magician", 3000)
+        ]
+        cursor.executemany("INSERT INTO addons (name, price) VALUES (?, ?)", addons)
+    # Insert default data for masterclasses
+    cursor.execute("SELECT COUNT(*) FROM masterclasses")
+    if cursor.fetchone()[0] == 0:
+        masterclasses = [
+            ("Young Confectioner", 350),
+            ("Young Artist", 250),
+            ("Slime Lab", 300)
+        ]
+        cursor.executemany("INSERT INTO masterclasses (name, price_per_child) VALUES (?, ?)", masterclasses)
+
+
+def _migration_booking_items(cursor):
+    # Доп. услуги и мастер-классы заказа вместо JSON в колонках bookings
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS booking_addons (
+            booking_id INTEGER NOT NULL,
+            addon_id INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS booking_masterclasses (
+            booking_id INTEGER NOT NULL,
+            masterclass_id INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_addons_booking ON booking_addons (booking_id, addon_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_addons_addon ON booking_addons (addon_id, booking_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_masterclasses_booking "
+                   "ON booking_masterclasses (booking_id, masterclass_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_masterclasses_masterclass "
+                   "ON booking_masterclasses (masterclass_id, booking_id)")
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS bookings_delete_items BEFORE DELETE ON bookings
+        BEGIN
+            DELETE FROM booking_addons WHERE booking_id = OLD.id;
+            DELETE FROM booking_masterclasses WHERE booking_id = OLD.id;
+        END
+    """)
+
+
+def _backfill_booking_items(cursor, after_id, batch_size):
+    cursor.execute("""
+        SELECT id, addon_ids, masterclass_ids FROM bookings
+        WHERE id > ? AND (addon_ids IS NOT NULL OR masterclass_ids IS NOT NULL)
+        ORDER BY id LIMIT ?
+    """, (after_id, batch_size))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    addons = []
+    masterclasses = []
+    for booking_id, addon_ids, masterclass_ids in rows:
+        addons.extend((booking_id, addon_id) for addon_id in json.loads(addon_ids or "[]"))
+        masterclasses.extend((booking_id, masterclass_id) for masterclass_id in json.loads(masterclass_ids or "[]"))
+    cursor.executemany("INSERT INTO booking_addons (booking_id, addon_id) VALUES (?, ?)", addons)
+    cursor.executemany("INSERT INTO booking_masterclasses (booking_id, masterclass_id) VALUES (?, ?)", masterclasses)
+    cursor.executemany("UPDATE bookings SET addon_ids = NULL, masterclass_ids = NULL WHERE id = ?",
+                       [(row[0],) for row in rows])
+    return rows[-1][0]
+
+
+def _migration_booking_indexes(cursor):
+    # Индексы под постраничную выдачу (date, id) и фильтры списка заказов
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_date ON bookings (date, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_completed_date ON bookings (completed, date, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_event_type_date ON bookings (event_type, date, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_program_date ON bookings (program_id, date, id)")
+
+
+def _migration_daily_occupancy(cursor):
+    # Занятость по дням поддерживается триггерами, чтобы проверка вместимости не сканировала bookings
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_occupancy (
+            date TEXT PRIMARY KEY,
+            bookings INTEGER NOT NULL,
+            guests INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("DELETE FROM daily_occupancy")
+    cursor.execute("""
+        INSERT INTO daily_occupancy (date, bookings, guests)
+        SELECT date, COUNT(*), SUM(guest_count) FROM bookings GROUP BY date
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS bookings_occupancy_insert AFTER INSERT ON bookings
+        BEGIN
+            INSERT INTO daily_occupancy (date, bookings, guests) VALUES (NEW.date, 1, NEW.guest_count)
+            ON CONFLICT (date) DO UPDATE SET bookings = bookings + 1, guests = guests + excluded.guests;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS bookings_occupancy_delete AFTER DELETE ON bookings
+        BEGIN
+            UPDATE daily_occupancy SET bookings = bookings - 1, guests = guests - OLD.guest_count WHERE date = OLD.date;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS bookings_occupancy_update AFTER UPDATE OF date, guest_count ON bookings
+        BEGIN
+            UPDATE daily_occupancy SET bookings = bookings - 1, guests = guests - OLD.guest_count WHERE date = OLD.date;
+            INSERT INTO daily_occupancy (date, bookings, guests) VALUES (NEW.date, 1, NEW.guest_count)
+            ON CONFLICT (date) DO UPDATE SET bookings = bookings + 1, guests = guests + excluded.guests;
+        END
+    """)
+
+
+ROLLUP_UPSERTS = {
+    "revenue_daily": """
+        INSERT INTO revenue_daily (date, event_type, program_id, completed, bookings, guests, revenue)
+        VALUES ({r}.date, {r}.event_type, COALESCE({r}.program_id, 0), {r}.completed, {sign}, {sign} * {r}.guest_count,
+                {sign} * {r}.total_price)
+        ON CONFLICT (date, event_type, program_id, completed) DO UPDATE SET
+            bookings = bookings + excluded.bookings, guests = guests + excluded.guests, revenue = revenue + excluded.revenue;
+    """,
+    "revenue_monthly": """
+        INSERT INTO revenue_monthly (month, event_type, program_id, completed, bookings, guests, revenue)
+        VALUES (substr({r}.date, 1, 7), {r}.event_type, COALESCE({r}.program_id, 0), {r}.completed, {sign},
+                {sign} * {r}.guest_count, {sign} * {r}.total_price)
+        ON CONFLICT (month, event_type, program_id, completed) DO UPDATE SET
+            bookings = bookings + excluded.bookings, guests = guests + excluded.guests, revenue = revenue + excluded.revenue;
+    """,
+}
+
+ITEM_ROLLUP_UPSERT = """
+    INSERT INTO item_sales_daily (date, item_type, item_id, quantity, seats)
+    SELECT b.date, '{item_type}', {r}.{item_column}, {sign}, {sign} * {seats}
+    FROM bookings b WHERE b.id = {r}.booking_id
+    ON CONFLICT (date, item_type, item_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity, seats = seats + excluded.seats;
+"""
+
+ITEM_TABLES = [
+    # (тип позиции, связующая таблица, колонка id, сколько мест занимает позиция)
+    ("addon", "booking_addons", "addon_id", "0"),
+    ("masterclass", "booking_masterclasses", "masterclass_id", "b.guest_count"),
+]
+
+
+def _booking_tiers(cursor):
+    # Таблицы заказов с их доп. услугами и мастер-классами: оперативные и, если уже созданы, архивные
+    tiers = [("bookings", "booking_addons", "booking_masterclasses")]
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bookings_archive'")
+    if cursor.fetchone():
+        tiers.append(("bookings_archive", "booking_addons_archive", "booking_masterclasses_archive"))
+    return tiers
+
+
+def rebuild_rollups(cursor):
+    # Полный пересчёт сводных таблиц по текущим и архивным заказам
+    tiers = _booking_tiers(cursor)
+    cursor.execute("DELETE FROM revenue_daily")
+    cursor.execute("DELETE FROM revenue_monthly")
+    cursor.execute("DELETE FROM item_sales_daily")
+    sources = " UNION ALL ".join(
+        f"SELECT date, event_type, program_id, completed, guest_count, total_price FROM {bookings}"
+        for bookings, _, _ in tiers
+    )
+    cursor.execute(f"""
+        INSERT INTO revenue_daily (date, event_type, program_id, completed, bookings, guests, revenue)
+        SELECT date, event_type, COALESCE(program_id, 0), completed, COUNT(*), SUM(guest_count), SUM(total_price)
+        FROM ({sources}) GROUP BY 1, 2, 3, 4
+    """)
+    cursor.execute("""
+        INSERT INTO revenue_monthly (month, event_type, program_id, completed, bookings, guests, revenue)
+        SELECT substr(date, 1, 7), event_type, program_id, completed, SUM(bookings), SUM(guests), SUM(revenue)
+        FROM revenue_daily GROUP BY 1, 2, 3, 4
+    """)
+    for bookings, *item_tables in tiers:
+        for (item_type, _, column, seats), table in zip(ITEM_TABLES, item_tables):
+            cursor.execute(f"""
+                INSERT INTO item_sales_daily (date, item_type, item_id, quantity, seats)
+                SELECT b.date, '{item_type}', i.{column}, COUNT(*), SUM({seats})
+                FROM {table} i JOIN {bookings} b ON b.id = i.booking_id GROUP BY 1, 3
+                ON CONFLICT (date, item_type, item_id) DO UPDATE SET
+                    quantity = quantity + excluded.quantity, seats = seats + excluded.seats
             """)
-            # Bookings table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS bookings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date TEXT NOT NULL,
-                    event_type TEXT NOT NULL,
-                    guest_count INTEGER NOT NULL,
-                    phone TEXT NOT NULL,
-                    child_name TEXT NOT NULL,
-                    program_id INTEGER,
-                    addon_ids TEXT,
-                    masterclass_ids TEXT,
-                    total_price INTEGER NOT NULL,
-                    completed INTEGER NOT NULL DEFAULT 0,
-                    FOREIGN KEY (program_id) REFERENCES programs(id)
-                )
+
+
+def _migration_rollups(cursor):
+    # Сводные таблицы выручки по дням и месяцам и продаж доп. услуг и мастер-классов по дням
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS revenue_daily (
+            date TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            program_id INTEGER NOT NULL,
+            completed INTEGER NOT NULL,
+            bookings INTEGER NOT NULL,
+            guests INTEGER NOT NULL,
+            revenue INTEGER NOT NULL,
+            PRIMARY KEY (date, event_type, program_id, completed)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS revenue_monthly (
+            month TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            program_id INTEGER NOT NULL,
+            completed INTEGER NOT NULL,
+            bookings INTEGER NOT NULL,
+            guests INTEGER NOT NULL,
+            revenue INTEGER NOT NULL,
+            PRIMARY KEY (month, event_type, program_id, completed)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS item_sales_daily (
+            date TEXT NOT NULL,
+            item_type TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            seats INTEGER NOT NULL,
+            PRIMARY KEY (date, item_type, item_id)
+        ) WITHOUT ROWID
+    """)
+    add_new = "".join(sql.format(r="NEW", sign=1) for sql in ROLLUP_UPSERTS.values())
+    remove_old = "".join(sql.format(r="OLD", sign=-1) for sql in ROLLUP_UPSERTS.values())
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS bookings_rollup_insert AFTER INSERT ON bookings BEGIN {add_new} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS bookings_rollup_delete AFTER DELETE ON bookings BEGIN {remove_old} END")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS bookings_rollup_update
+        AFTER UPDATE OF date, event_type, program_id, completed, guest_count, total_price ON bookings
+        BEGIN {remove_old} {add_new} END
+    """)
+    for item_type, table, column, seats in ITEM_TABLES:
+        for event, r, sign in (("INSERT", "NEW", 1), ("DELETE", "OLD", -1)):
+            upsert = ITEM_ROLLUP_UPSERT.format(item_type=item_type, item_column=column, seats=seats, r=r, sign=sign)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_rollup_{event.lower()} AFTER {event} ON {table}
+                BEGIN {upsert} END
             """)
-            # Users table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL UNIQUE,
-                    password TEXT NOT NULL,
-                    role TEXT NOT NULL CHECK(role IN ('admin', 'user'))
-                )
+        # Перенос продаж позиций при изменении даты или числа гостей заказа
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_rollup_booking_update AFTER UPDATE OF date, guest_count ON bookings
+            BEGIN
+                INSERT INTO item_sales_daily (date, item_type, item_id, quantity, seats)
+                SELECT OLD.date, '{item_type}', {column}, -1, -{seats.replace("b.", "OLD.")}
+                FROM {table} WHERE booking_id = OLD.id
+                ON CONFLICT (date, item_type, item_id) DO UPDATE SET
+                    quantity = quantity + excluded.quantity, seats = seats + excluded.seats;
+                INSERT INTO item_sales_daily (date, item_type, item_id, quantity, seats)
+                SELECT NEW.date, '{item_type}', {column}, 1, {seats.replace("b.", "NEW.")}
+                FROM {table} WHERE booking_id = NEW.id
+                ON CONFLICT (date, item_type, item_id) DO UPDATE SET
+                    quantity = quantity + excluded.quantity, seats = seats + excluded.seats;
+            END
+        """)
+    rebuild_rollups(cursor)
+
+
+def _search_text(value):
+    # unicode61 не считает ё и е одной буквой, поэтому в индекс попадает текст с ё, замененной на е
+    return f"replace(replace({value}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _search_values(r, phone=None):
+    return ", ".join((_search_text(f"{r}.child_name"), phone or _search_text(f"{r}.phone"), _search_text(f"{r}.event_type")))
+
+
+def _search_phone(r):
+    # Телефон в индексе - только цифры, в виде 7XXXXXXXXXX и без 7 (национальный номер),
+    # чтобы его находили по любому началу: "7912...", "912...", "8912..." (запрос тоже нормализуется)
+    return (f"CASE WHEN length({r}.phone_normalized) = 11 AND {r}.phone_normalized LIKE '7%' "
+            f"THEN {r}.phone_normalized || ' ' || substr({r}.phone_normalized, 2) "
+            f"ELSE COALESCE({r}.phone_normalized, {_search_text(f'{r}.phone')}) END")
+
+
+def _create_search_triggers(cursor, values, columns):
+    # Поддержка индекса bookings_fts: values(r) - индексируемые значения строки r, columns - колонки bookings,
+    # изменение которых требует переиндексации
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS bookings_fts_insert AFTER INSERT ON bookings
+        BEGIN
+            INSERT INTO bookings_fts (rowid, child_name, phone, event_type) VALUES (NEW.id, {values("NEW")});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS bookings_fts_delete AFTER DELETE ON bookings
+        BEGIN
+            INSERT INTO bookings_fts (bookings_fts, rowid, child_name, phone, event_type)
+            VALUES ('delete', OLD.id, {values("OLD")});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS bookings_fts_update AFTER UPDATE OF {columns} ON bookings
+        BEGIN
+            INSERT INTO bookings_fts (bookings_fts, rowid, child_name, phone, event_type)
+            VALUES ('delete', OLD.id, {values("OLD")});
+            INSERT INTO bookings_fts (rowid, child_name, phone, event_type) VALUES (NEW.id, {values("NEW")});
+        END
+    """)
+
+
+def _migration_booking_search(cursor):
+    # Полнотекстовый индекс по имени ребенка, телефону и типу события; сами строки берутся из bookings по rowid
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS bookings_fts USING fts5(
+            child_name, phone, event_type, content='', tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    # Совпадение по имени и телефону весит больше, чем по типу события
+    cursor.execute("INSERT INTO bookings_fts (bookings_fts, rank) VALUES ('rank', 'bm25(2.0, 2.0, 1.0)')")
+    cursor.execute("INSERT INTO bookings_fts (bookings_fts) VALUES ('delete-all')")
+    cursor.execute(f"""
+        INSERT INTO bookings_fts (rowid, child_name, phone, event_type)
+        SELECT b.id, {_search_values("b")} FROM bookings b
+    """)
+    _create_search_triggers(cursor, _search_values, "child_name, phone, event_type")
+
+
+def _migration_phone_normalized(cursor):
+    # Нормализованный телефон для поиска истории клиента; заполняется при вставке и порциями для старых заказов
+    cursor.execute("ALTER TABLE bookings ADD COLUMN phone_normalized TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_phone_normalized ON bookings (phone_normalized, date)")
+
+
+def _backfill_phone_normalized(cursor, after_id, batch_size):
+    cursor.execute("SELECT id, phone FROM bookings WHERE id > ? ORDER BY id LIMIT ?", (after_id, batch_size))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    cursor.executemany("UPDATE bookings SET phone_normalized = ? WHERE id = ?",
+                       [(normalize_phone(phone), booking_id) for booking_id, phone in rows])
+    return rows[-1][0]
+
+
+def _migration_shared_state(cursor):
+    # Состояние, общее для всех процессов API: версия каталога для их кешей и отзыв токенов удалённых пользователей
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_version', 0)")
+    # Метка базы в ETag каталога: номера версий разных баз не должны совпадать
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('instance', lower(hex(randomblob(4))))")
+    for table in ("programs", "addons", "masterclasses"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_catalog_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE meta SET value = value + 1 WHERE key = 'catalog_version';
+                END
             """)
-            # Add completed column if not exists
-            cursor.execute("PRAGMA table_info(bookings)")
-            columns = [col[1] for col in cursor.fetchall()]
-            if "completed" not in columns:
-                cursor.execute("ALTER TABLE bookings ADD COLUMN completed INTEGER NOT NULL DEFAULT 0")
-            # Check if default admin exists
-            cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
-            if cursor.fetchone()[0] == 0:
-                # Default admin: username='admin', password='admin123'
-                cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                              ("admin", hashlib.sha256("admin123".encode()).hexdigest(), "admin"))
-            # Insert default data for programs
-            cursor.execute("SELECT COUNT(*) FROM programs")
-            if cursor.fetchone()[0] == 0:
-                programs = [
-                    ("Transformers", 8000),
-                    ("Lady Bug", 8000),
-                    ("Disney", 8000),
-                    ("Super Heroes", 8000)
-                ]
-                cursor.executemany("INSERT INTO programs (name, price) VALUES (?, ?)", programs)
-            # Insert default data for addons
-            cursor.execute("SELECT COUNT(*) FROM addons")
-            if cursor.fetchone()[0] == 0:
-                addons = [
-                    ("Soap Show", 2000),
-                    ("Magic Disco", 2000),
-                    ("Magician", 3000)
-                ]
-                cursor.executemany("INSERT INTO addons (name, price) VALUES (?, ?)", addons)
-            # Insert default data for masterclasses
-            cursor.execute("SELECT COUNT(*) FROM masterclasses")
-            if cursor.fetchone()[0] == 0:
-                masterclasses = [
-                    ("Young Confectioner", 350),
-                    ("Young Artist", 250),
-                    ("Slime Lab", 300)
-                ]
-                cursor.executemany("INSERT INTO masterclasses (name, price_per_child) VALUES (?, ?)", masterclasses)
-            self._initialized = True
\ No newline at end of file
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS token_revocations (
+            username TEXT PRIMARY KEY,
+            revoked_at REAL NOT NULL
+        )
+    """)
+
+
+def _migration_booking_events(cursor):
+    # Журнал событий по заказам для потока /bookings/events; пишется в той же транзакции, что и изменение.
+    # Общие для всех процессов номера событий позволяют продолжить поток с Last-Event-ID на любом воркере
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS booking_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            booking_id INTEGER,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_events_created_at ON booking_events (created_at)")
+
+
+def _migration_booking_changes(cursor):
+    # Версия изменения заказа для дельта-синхронизации: по одной строке на заказ с номером последнего изменения,
+    # удалённые заказы остаются строками-надгробиями. Счётчик версий - в meta, увеличивается под блокировкой записи,
+    # поэтому номера растут в порядке фиксации транзакций и во всех процессах.
+    # Доп. услуги и мастер-классы меняются только вместе с созданием заказа, поэтому отдельно не отслеживаются
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS booking_changes (
+            booking_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_booking_changes_version ON booking_changes (version)")
+    # Существующим заказам достаются версии, равные их id: так номера уникальны и страницы не рвут одну версию
+    cursor.execute("DELETE FROM booking_changes")
+    cursor.execute("INSERT INTO booking_changes (booking_id, version, deleted) SELECT id, id, 0 FROM bookings")
+    cursor.execute("""
+        INSERT OR REPLACE INTO meta (key, value) VALUES ('bookings_version', (SELECT COALESCE(MAX(id), 0) FROM bookings))
+    """)
+    next_version = "UPDATE meta SET value = value + 1 WHERE key = 'bookings_version';"
+    change = """
+        INSERT OR REPLACE INTO booking_changes (booking_id, version, deleted)
+        VALUES ({r}.id, (SELECT value FROM meta WHERE key = 'bookings_version'), {deleted});
+    """
+    for event, r, deleted in (("INSERT", "NEW", 0), ("UPDATE", "NEW", 0), ("DELETE", "OLD", 1)):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS bookings_changes_{event.lower()} AFTER {event} ON bookings
+            BEGIN {next_version} {change.format(r=r, deleted=deleted)} END
+        """)
+
+
+def _migration_archive(cursor):
+    # Архив завершённых заказов в той же базе: оперативная таблица bookings и её индексы остаются небольшими.
+    # id при переносе сохраняются (AUTOINCREMENT не выдаёт их повторно), поэтому они уникальны в обеих таблицах
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bookings_archive (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            guest_count INTEGER NOT NULL,
+            phone TEXT NOT NULL,
+            phone_normalized TEXT,
+            child_name TEXT NOT NULL,
+            program_id INTEGER,
+            total_price INTEGER NOT NULL,
+            completed INTEGER NOT NULL,
+            archived_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_archive_date ON bookings_archive (date, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_archive_phone_normalized "
+                   "ON bookings_archive (phone_normalized, date)")
+    for table, column in (("booking_addons", "addon_id"), ("booking_masterclasses", "masterclass_id")):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table}_archive (
+                booking_id INTEGER NOT NULL,
+                {column} INTEGER NOT NULL
+            )
+        """)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_archive_booking ON {table}_archive (booking_id, {column})")
+    # Перенос в архив удаляет строки из bookings; флаг archiving в meta (виден только внутри транзакции переноса)
+    # отключает триггеры, которые иначе вычли бы перенесённые заказы из занятости по дням и сводных таблиц
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('archiving', 0)")
+    not_archiving = "(SELECT value FROM meta WHERE key = 'archiving') = 0"
+    cursor.execute("DROP TRIGGER IF EXISTS bookings_occupancy_delete")
+    cursor.execute(f"""
+        CREATE TRIGGER bookings_occupancy_delete AFTER DELETE ON bookings WHEN {not_archiving}
+        BEGIN
+            UPDATE daily_occupancy SET bookings = bookings - 1, guests = guests - OLD.guest_count WHERE date = OLD.date;
+        END
+    """)
+    remove_old = "".join(sql.format(r="OLD", sign=-1) for sql in ROLLUP_UPSERTS.values())
+    cursor.execute("DROP TRIGGER IF EXISTS bookings_rollup_delete")
+    cursor.execute(f"CREATE TRIGGER bookings_rollup_delete AFTER DELETE ON bookings WHEN {not_archiving} BEGIN {remove_old} END")
+    for item_type, table, column, seats in ITEM_TABLES:
+        upsert = ITEM_ROLLUP_UPSERT.format(item_type=item_type, item_column=column, seats=seats, r="OLD", sign=-1)
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_rollup_delete")
+        cursor.execute(f"""
+            CREATE TRIGGER {table}_rollup_delete AFTER DELETE ON {table} WHEN {not_archiving}
+            BEGIN {upsert} END
+        """)
+
+
+def _migration_search_phone_digits(cursor):
+    # Переиндексация телефонов цифрами: набранный как "+7 (912) 345-67-89" номер раньше разбивался на части
+    # 7/912/345/67/89 и не находился ни целиком, ни по началу
+    def values(r):
+        return _search_values(r, _search_phone(r))
+
+    for event in ("insert", "delete", "update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS bookings_fts_{event}")
+    cursor.execute("INSERT INTO bookings_fts (bookings_fts) VALUES ('delete-all')")
+    cursor.execute(f"INSERT INTO bookings_fts (rowid, child_name, phone, event_type) SELECT b.id, {values('b')} FROM bookings b")
+    _create_search_triggers(cursor, values, "child_name, phone, phone_normalized, event_type")
+
+
+def _migration_archive_changes(cursor):
+    # Перенос в архив - не удаление: клиенты дельта-синхронизации, показывающие и архив, не должны терять
+    # такие заказы. Строка перенесённого заказа помечается archived = 1 вместе с deleted = 1
+    cursor.execute("ALTER TABLE booking_changes ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("DROP TRIGGER IF EXISTS bookings_changes_delete")
+    cursor.execute("""
+        CREATE TRIGGER bookings_changes_delete AFTER DELETE ON bookings
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'bookings_version';
+            INSERT OR REPLACE INTO booking_changes (booking_id, version, deleted, archived)
+            VALUES (OLD.id, (SELECT value FROM meta WHERE key = 'bookings_version'), 1,
+                    (SELECT value FROM meta WHERE key = 'archiving'));
+        END
+    """)
+
+
+class BatchedMigration:
+    # Переносит данные порциями в отдельных транзакциях, чтобы не держать блокировку записи долго.
+    # step(cursor, after_id, batch_size) возвращает последний обработанный id или None, когда всё перенесено.
+    def __init__(self, step, batch_size=500):
+        self.step = step
+        self.batch_size = batch_size
+
+
+# Миграции применяются по порядку; номер версии схемы хранится в PRAGMA user_version
+MIGRATIONS = [
+    _migration_initial_schema,
+    _migration_booking_items,
+    BatchedMigration(_backfill_booking_items),
+    _migration_booking_indexes,
+    _migration_daily_occupancy,
+    _migration_rollups,
+    _migration_booking_search,
+    _migration_phone_normalized,
+    BatchedMigration(_backfill_phone_normalized),
+    _migration_shared_state,
+    _migration_booking_events,
+    _migration_booking_changes,
+    _migration_archive,
+    _migration_search_phone_digits,
+    _migration_archive_changes,
+]
+
+
+# Повторы при SQLITE_BUSY сверх busy_timeout: несколько процессов API пишут в одну базу
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05
+
+
+def is_busy_error(error):
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        # SQLITE_BUSY и SQLITE_LOCKED вместе с расширенными кодами
+        return code & 0xFF in (5, 6)
+    message = str(error)
+    return "locked" in message or "busy" in message
+
+
+def retry_on_busy(func, retries=BUSY_RETRIES, backoff=BUSY_BACKOFF):
+    # Экспоненциальная задержка со случайной добавкой, чтобы процессы не повторяли попытки одновременно
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except sqlite3.OperationalError as e:
+            if attempt == retries or not is_busy_error(e):
+                raise
+            time.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+
+
+@contextmanager
+def immediate_transaction(conn):
+    if conn.in_transaction:
+        conn.commit()
+    # Блокировка записи берётся сразу: внутри транзакции SQLITE_BUSY уже не возникнет, а повторять BEGIN безопасно
+    retry_on_busy(lambda: conn.execute("BEGIN IMMEDIATE"))
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _user_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    version = _user_version(conn)
+    after_id = 0
+    while version < len(MIGRATIONS):
+        with immediate_transaction(conn):
+            # Другой процесс мог успеть применить миграцию, пока мы ждали блокировку
+            if _user_version(conn) == version:
+                migration = MIGRATIONS[version]
+                if isinstance(migration, BatchedMigration):
+                    after_id = migration.step(conn.cursor(), after_id, migration.batch_size)
+                    if after_id is None:
+                        conn.execute(f"PRAGMA user_version = {version + 1}")
+                else:
+                    migration(conn.cursor())
+                    conn.execute(f"PRAGMA user_version = {version + 1}")
+        current = _user_version(conn)
+        if current != version:
+            after_id = 0
+        version = current
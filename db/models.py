@@ -1,105 +1,745 @@
-import sqlite3
-from db.database import Database
+import asyncio
+import contextvars
+import functools
 import json
-import hashlib
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from db.database import Database, immediate_transaction, rebuild_rollups
+from db.pricing import PriceEngine
+from db.passwords import DEFAULT_KDF_PARAMS, hash_password, needs_rehash, verify_password
+from db.phones import normalize_phone
+
+
+def _booking_columns(tier=""):
+    # Списки доп. услуг и мастер-классов собираются из связующих таблиц в том же запросе;
+    # tier="_archive" - те же колонки для архива завершённых заказов
+    return f"""
+    b.id, b.date, b.event_type, b.guest_count, b.phone, b.child_name, b.program_id,
+    (SELECT group_concat(addon_id) FROM booking_addons{tier} WHERE booking_id = b.id) AS addon_ids,
+    (SELECT group_concat(masterclass_id) FROM booking_masterclasses{tier} WHERE booking_id = b.id) AS masterclass_ids,
+    b.total_price, b.completed
+"""
+
+
+BOOKING_COLUMNS = _booking_columns()
+BOOKING_SELECT = f"SELECT {BOOKING_COLUMNS} FROM bookings b"
+ARCHIVE_SELECT = f"SELECT {_booking_columns('_archive')} FROM bookings_archive b"
+
+
+def _split_ids(value):
+    return [int(item_id) for item_id in value.split(",")] if value else []
+
+
+def booking_from_row(row):
+    booking = dict(row)
+    booking.pop("search_rank", None)
+    booking["addon_ids"] = _split_ids(booking["addon_ids"])
+    booking["masterclass_ids"] = _split_ids(booking["masterclass_ids"])
+    return booking
+
+
+def booking_filter_clause(date_from=None, date_to=None, completed=None, event_type=None, program_id=None):
+    clauses = []
+    params = []
+    if date_from is not None:
+        clauses.append("b.date >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        clauses.append("b.date <= ?")
+        params.append(date_to)
+    if completed is not None:
+        clauses.append("b.completed = ?")
+        params.append(int(completed))
+    if event_type is not None:
+        clauses.append("b.event_type = ?")
+        params.append(event_type)
+    if program_id is not None:
+        clauses.append("b.program_id = ?")
+        params.append(program_id)
+    return clauses, params
+
+
+def tiered_select(where, params, include_archived=False):
+    # Выборка заказов с условием where; с include_archived к ней через UNION ALL добавляется архив
+    # с тем же условием. Сортировать результат нужно по именам колонок (date, id), а не b.date
+    if not include_archived:
+        return f"{BOOKING_SELECT} {where}", list(params)
+    return f"{BOOKING_SELECT} {where} UNION ALL {ARCHIVE_SELECT} {where}", [*params, *params]
+
+
+# Цифры, разделённые только пробелами, скобками и дефисами, - один телефонный номер
+SEARCH_TERM = re.compile(r"(\d[\d\s()-]*\d|\d)|(\w+)")
+
+
+def search_match_expression(text):
+    # Каждое слово запроса ищется по префиксу; слова в кавычках, чтобы символы синтаксиса FTS5 не мешали.
+    # ё заменяется на е, а номер телефона нормализуется так же, как при индексации
+    terms = []
+    for digits, word in SEARCH_TERM.findall(text.replace("ё", "е").replace("Ё", "Е")):
+        if not digits:
+            terms.append(f'"{word}"*')
+            continue
+        phone = normalize_phone(digits)
+        if phone.startswith("8") and len(phone) < 11:
+            # Начало номера, набранного через 8: в индексе он хранится с 7
+            terms.append(f'("{phone}"* OR "7{phone[1:]}"*)')
+        else:
+            terms.append(f'"{phone}"*')
+    return " ".join(terms) or None
+
+
+class CapacityExceededError(Exception):
+    pass
+
+
+CatalogCacheInfo = namedtuple("CatalogCacheInfo", ["hits", "misses", "version"])
+
+
+class Catalog:
+    # Неизменяемый снимок каталога: программы, доп. услуги, мастер-классы и движок расчёта цен по ним
+    def __init__(self, version, etag, programs, addons, masterclasses):
+        self.version = version
+        self.etag = etag
+        self.programs = programs
+        self.addons = addons
+        self.masterclasses = masterclasses
+        self.pricing = PriceEngine(programs, addons, masterclasses)
+        self.program_names = {p["id"]: p["name"] for p in programs}
+        self.addon_names = {a["id"]: a["name"] for a in addons}
+        self.masterclass_names = {m["id"]: m["name"] for m in masterclasses}
 
 
 class BookingModel:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, kdf_params=None, venue_capacity=None, write_queue=None, catalog_check_interval=1.0):
         self.db = db
+        self.kdf_params = kdf_params or DEFAULT_KDF_PARAMS
+        # Сколько гостей площадка принимает за день; None - без ограничения
+        self.venue_capacity = venue_capacity
+        # Необязательная очередь групповой фиксации (db.writer.WriteQueue) для создания, удаления и завершения заказов
+        self.write_queue = write_queue
         # Database is already initialized by Database class
+        self._catalog = None
+        # Версию каталога увеличивают триггеры в таблице meta, поэтому изменения из других процессов
+        # (воркеров API, GUI, скриптов) замечаются не позже чем через catalog_check_interval секунд.
+        # None - версию обновляет сам владелец модели вызовом refresh_catalog_version (API делает это в фоне,
+        # чтобы не читать базу в цикле событий)
+        self.catalog_check_interval = catalog_check_interval
+        self._catalog_checked_at = None
+        self._catalog_invalidations = 0
+        with self.db.get_connection() as conn:
+            rows = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('instance', 'catalog_version')").fetchall())
+        self._catalog_epoch = rows["instance"]
+        self._catalog_version = rows["catalog_version"]
+        self._catalog_lock = threading.Lock()
+        self._catalog_hits = 0
+        self._catalog_misses = 0
+
+    def _check_catalog_version(self):
+        if self.catalog_check_interval is None:
+            return
+        now = time.monotonic()
+        with self._catalog_lock:
+            if self._catalog_checked_at is not None and now - self._catalog_checked_at < self.catalog_check_interval:
+                return
+            self._catalog_checked_at = now
+        self.refresh_catalog_version()
+
+    def refresh_catalog_version(self):
+        # Сверяет версию каталога с базой; снимок другой версии сбрасывается
+        with self.db.get_connection() as conn:
+            version = conn.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()[0]
+        with self._catalog_lock:
+            if version != self._catalog_version:
+                self._catalog_version = version
+                self._catalog = None
+        return version
+
+    def get_catalog(self):
+        self._check_catalog_version()
+        with self._catalog_lock:
+            catalog = self._catalog
+            if catalog is not None:
+                self._catalog_hits += 1
+                return catalog
+            self._catalog_misses += 1
+            invalidations = self._catalog_invalidations
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            # Версия читается до данных: при одновременном изменении снимок лишь перезагрузится ещё раз
+            cursor.execute("SELECT value FROM meta WHERE key = 'catalog_version'")
+            version = cursor.fetchone()[0]
+            cursor.execute("SELECT * FROM programs")
+            programs = [dict(row) for row in cursor.fetchall()]
+            cursor.execute("SELECT * FROM addons")
+            addons = [dict(row) for row in cursor.fetchall()]
+            cursor.execute("SELECT * FROM masterclasses")
+            masterclasses = [dict(row) for row in cursor.fetchall()]
+        catalog = Catalog(version, self._etag(version), programs, addons, masterclasses)
+        with self._catalog_lock:
+            # Если за время загрузки каталог изменили в этом процессе или замечена более новая версия, снимок устарел
+            if invalidations == self._catalog_invalidations and version >= self._catalog_version:
+                self._catalog_version = version
+                self._catalog = catalog
+        return catalog
+
+    def _etag(self, version):
+        return f'"catalog-{self._catalog_epoch}-{version}"'
+
+    def catalog_etag(self):
+        # ETag загруженного снимка каталога; None - снимок устарел или ещё не загружен и его нужно прочитать
+        # через get_catalog. Без catalog_check_interval база не читается
+        self._check_catalog_version()
+        with self._catalog_lock:
+            return self._catalog.etag if self._catalog is not None else None
+
+    def invalidate_catalog(self):
+        # Новую версию уже записали триггеры; следующее обращение перечитает её из базы
+        with self._catalog_lock:
+            self._catalog = None
+            self._catalog_checked_at = None
+            self._catalog_invalidations += 1
+
+    def catalog_cache_info(self):
+        with self._catalog_lock:
+            return CatalogCacheInfo(self._catalog_hits, self._catalog_misses, self._catalog_version)
 
     def create_user(self, username, password, role="user"):
+        return self.add_user(username, hash_password(password, **self.kdf_params), role)
+
+    def add_user(self, username, password_hash, role="user"):
+        with self.db.get_connection() as conn:
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                try:
+                    cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                                  (username, password_hash, role))
+                    return True
+                except sqlite3.IntegrityError:
+                    return False
+
+    def get_credentials(self, username):
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            hashed_password = hashlib.sha256(password.encode()).hexdigest()
-            try:
-                cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                              (username, hashed_password, role))
-                return True
-            except sqlite3.IntegrityError:
-                return False
+            cursor.execute("SELECT password, role FROM users WHERE username = ?", (username,))
+            result = cursor.fetchone()
+            return (result[0], result[1]) if result else None
+
+    def update_password_hash(self, username, password_hash):
+        with self.db.get_connection() as conn:
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                cursor.execute("UPDATE users SET password = ? WHERE username = ?", (password_hash, username))
 
     def authenticate_user(self, username, password):
+        credentials = self.get_credentials(username)
+        if not credentials or not verify_password(credentials[0], password):
+            return None
+        # Старые хеши sha256 и хеши с устаревшими параметрами пересчитываются при входе
+        if needs_rehash(credentials[0], **self.kdf_params):
+            self.update_password_hash(username, hash_password(password, **self.kdf_params))
+        return credentials[1]
+
+    def delete_user(self, username):
+        # Вместе с пользователем отзываются его токены: запись в token_revocations видят все процессы API
+        with self.db.get_connection() as conn:
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM users WHERE username = ?", (username,))
+                if cursor.rowcount == 0:
+                    return False
+                cursor.execute("INSERT OR REPLACE INTO token_revocations (username, revoked_at) VALUES (?, ?)",
+                               (username, time.time()))
+                return True
+
+    def get_token_revocations(self, since=0.0):
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            hashed_password = hashlib.sha256(password.encode()).hexdigest()
-            cursor.execute("SELECT role FROM users WHERE username = ? AND password = ?", (username, hashed_password))
-            result = cursor.fetchone()
-            return result[0] if result else None
+            cursor.execute("SELECT username, revoked_at FROM token_revocations WHERE revoked_at > ?", (since,))
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def _write(self, op, *args):
+        # Запись через очередь групповой фиксации, если она есть, иначе отдельной транзакцией
+        if self.write_queue is not None:
+            return self.write_queue.submit(op, *args).result()
+        with self.db.get_connection() as conn:
+            with immediate_transaction(conn):
+                return op(conn, *args)
 
     def create_booking(self, date, event_type, guest_count, phone, child_name, program_id, addon_ids, masterclass_ids, total_price):
+        return self._write(self._insert_booking, date, event_type, guest_count, phone, child_name, program_id,
+                           addon_ids, masterclass_ids, total_price)
+
+    def _insert_booking(self, conn, date, event_type, guest_count, phone, child_name, program_id, addon_ids,
+                        masterclass_ids, total_price):
+        cursor = conn.cursor()
+        if self.venue_capacity is not None:
+            cursor.execute("SELECT guests FROM daily_occupancy WHERE date = ?", (date,))
+            row = cursor.fetchone()
+            if (row[0] if row else 0) + guest_count > self.venue_capacity:
+                raise CapacityExceededError(f"Not enough capacity on {date}")
+        cursor.execute("""
+            INSERT INTO bookings (date, event_type, guest_count, phone, phone_normalized, child_name, program_id,
+                                  total_price, completed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+        """, (date, event_type, guest_count, phone, normalize_phone(phone), child_name, program_id, total_price))
+        booking_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO booking_addons (booking_id, addon_id) VALUES (?, ?)",
+                           [(booking_id, addon_id) for addon_id in addon_ids])
+        cursor.executemany("INSERT INTO booking_masterclasses (booking_id, masterclass_id) VALUES (?, ?)",
+                           [(booking_id, masterclass_id) for masterclass_id in masterclass_ids])
+        self._record_event(conn, "created", booking_id, {
+            "id": booking_id, "date": date, "event_type": event_type, "guest_count": guest_count, "phone": phone,
+            "child_name": child_name, "program_id": program_id, "addon_ids": list(addon_ids),
+            "masterclass_ids": list(masterclass_ids), "total_price": total_price, "completed": 0,
+        })
+        return booking_id
+
+    def _occupancy(self, cursor, dates):
+        guests = {}
+        dates = list(dates)
+        for start in range(0, len(dates), 500):
+            chunk = dates[start:start + 500]
+            cursor.execute(f"SELECT date, guests FROM daily_occupancy WHERE date IN ({','.join('?' * len(chunk))})", chunk)
+            guests.update(cursor.fetchall())
+        return guests
+
+    def create_bookings(self, bookings):
+        # Массовая вставка одной транзакцией; bookings - кортежи в порядке аргументов create_booking.
+        # Возвращает id в порядке входных данных, None - для заказов сверх вместимости площадки
+        with self.db.get_connection() as conn:
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                accepted = list(range(len(bookings)))
+                if self.venue_capacity is not None:
+                    guests = self._occupancy(cursor, {booking[0] for booking in bookings})
+                    accepted = []
+                    for index, booking in enumerate(bookings):
+                        booked = guests.get(booking[0], 0)
+                        if booked + booking[2] <= self.venue_capacity:
+                            guests[booking[0]] = booked + booking[2]
+                            accepted.append(index)
+                # id назначаются явно, чтобы связать заказы с доп. услугами без построчных вставок
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'bookings'")
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM bookings")
+                    row = cursor.fetchone()
+                booking_ids = [None] * len(bookings)
+                for offset, index in enumerate(accepted, row[0] + 1):
+                    booking_ids[index] = offset
+                rows = [(booking_ids[index], bookings[index]) for index in accepted]
+                cursor.executemany("""
+                    INSERT INTO bookings (id, date, event_type, guest_count, phone, phone_normalized, child_name, program_id,
+                                          total_price, completed)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+                """, [(booking_id, *booking[:4], normalize_phone(booking[3]), *booking[4:6], booking[8])
+                      for booking_id, booking in rows])
+                cursor.executemany("INSERT INTO booking_addons (booking_id, addon_id) VALUES (?, ?)",
+                                   [(booking_id, addon_id) for booking_id, booking in rows for addon_id in booking[6]])
+                cursor.executemany("INSERT INTO booking_masterclasses (booking_id, masterclass_id) VALUES (?, ?)",
+                                   [(booking_id, masterclass_id) for booking_id, booking in rows
+                                    for masterclass_id in booking[7]])
+                # Одно событие на всю загрузку: клиентам проще перечитать список, чем применять тысячи событий
+                if rows:
+                    self._record_event(conn, "imported", None, {"count": len(rows)})
+                return booking_ids
+
+    def get_occupancy(self, date_from, date_to):
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO bookings (date, event_type, guest_count, phone, child_name, program_id, addon_ids, masterclass_ids, total_price, completed)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
-            """, (date, event_type, guest_count, phone, child_name, program_id, json.dumps(addon_ids), json.dumps(masterclass_ids), total_price))
-            return cursor.lastrowid
+            cursor.execute("SELECT date, bookings, guests FROM daily_occupancy WHERE date BETWEEN ? AND ? AND bookings > 0",
+                           (date_from, date_to))
+            return {row["date"]: dict(row) for row in cursor.fetchall()}
 
     def get_all_bookings(self):
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM bookings")
-            return [dict(row) for row in cursor.fetchall()]
+            cursor.execute(BOOKING_SELECT)
+            return [booking_from_row(row) for row in cursor.fetchall()]
 
-    def delete_booking(self, booking_id):
+    def get_bookings(self, limit=100, after=None, include_archived=False, **filters):
+        # Постраничная выдача по ключу (date, id): after - ключ последней строки предыдущей страницы
+        clauses, params = booking_filter_clause(**filters)
+        if after is not None:
+            clauses.append("(b.date, b.id) > (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query, params = tiered_select(where, params, include_archived)
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
+            cursor.execute(f"{query} ORDER BY date, id LIMIT ?", (*params, limit + 1))
+            rows = cursor.fetchall()
+        bookings = [booking_from_row(row) for row in rows[:limit]]
+        next_key = (bookings[-1]["date"], bookings[-1]["id"]) if len(rows) > limit else None
+        return bookings, next_key
 
-    def mark_booking_completed(self, booking_id):
+    def iter_bookings(self, batch_size=1000, include_archived=False, **filters):
+        # Потоковое чтение курсором: в памяти не больше одной порции строк
+        clauses, params = booking_filter_clause(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query, params = tiered_select(where, params, include_archived)
+        with self.db.reader() as conn:
+            cursor = conn.execute(f"{query} ORDER BY date, id", params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield booking_from_row(row)
+
+    def search_bookings(self, query, limit=50, after=None, **filters):
+        # Результаты упорядочены по релевантности (rank FTS5, меньше - лучше);
+        # after - ключ (rank, id) последней строки предыдущей страницы
+        match = search_match_expression(query)
+        if match is None:
+            return [], None
+        clauses, params = booking_filter_clause(**filters)
+        clauses.insert(0, "bookings_fts MATCH ?")
+        params.insert(0, match)
+        if after is not None:
+            clauses.append("(s.rank, b.id) > (?, ?)")
+            params.extend(after)
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("UPDATE bookings SET completed = 1 WHERE id = ?", (booking_id,))
+            cursor.execute(f"""
+                SELECT s.rank AS search_rank, {BOOKING_COLUMNS}
+                FROM bookings_fts s JOIN bookings b ON b.id = s.rowid
+                WHERE {' AND '.join(clauses)}
+                ORDER BY s.rank, b.id LIMIT ?
+            """, (*params, limit + 1))
+            rows = cursor.fetchall()
+        next_key = (rows[limit - 1]["search_rank"], rows[limit - 1]["id"]) if len(rows) > limit else None
+        return [booking_from_row(row) for row in rows[:limit]], next_key
 
-    def get_programs(self):
+    def count_search_results(self, query, **filters):
+        match = search_match_expression(query)
+        if match is None:
+            return 0
+        clauses, params = booking_filter_clause(**filters)
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM programs")
-            return [dict(row) for row in cursor.fetchall()]
+            cursor.execute(f"""
+                SELECT COUNT(*) FROM bookings_fts s JOIN bookings b ON b.id = s.rowid
+                WHERE {' AND '.join(["bookings_fts MATCH ?", *clauses])}
+            """, (match, *params))
+            return cursor.fetchone()[0]
 
-    def get_addons(self):
+    def get_changes(self, since, limit=1000, instance=None):
+        # Заказы, изменённые после версии since, id удалённых (deleted) и перенесённых в архив (archived).
+        # version - до какой версии клиент теперь синхронизирован, instance - id базы, к которой она относится:
+        # клиент передаёт оба значения в следующий раз. При more=True за version есть ещё изменения.
+        # reset=True - версия клиента из другой (пересозданной, восстановленной) базы: локальную копию нужно
+        # сбросить, выдача идёт с начала
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM addons")
+            # Граница и изменения читаются из одного снимка (одной транзакции чтения): иначе изменения,
+            # зафиксированные между двумя запросами, оказались бы ниже возвращённой версии и потерялись
+            if not conn.in_transaction:
+                cursor.execute("BEGIN")
+            cursor.execute("SELECT key, value FROM meta WHERE key IN ('bookings_version', 'instance')")
+            state = dict(cursor.fetchall())
+            current = state["bookings_version"]
+            reset = since > 0 and (instance != state["instance"] or since > current)
+            if reset:
+                since = 0
+            # Загрузке с нуля удалять нечего: удалённые и перенесённые в архив заказы ей не выдаются
+            live_only = "AND c.deleted = 0" if since == 0 else ""
+            cursor.execute(f"""
+                SELECT c.version AS change_version, c.deleted AS change_deleted, c.archived AS change_archived,
+                       c.booking_id AS change_id, {BOOKING_COLUMNS}
+                FROM booking_changes c LEFT JOIN bookings b ON b.id = c.booking_id AND c.deleted = 0
+                WHERE c.version > ? AND c.version <= ? {live_only}
+                ORDER BY c.version LIMIT ?
+            """, (since, current, limit + 1))
+            rows = cursor.fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        bookings = []
+        deleted = []
+        archived = []
+        for row in rows:
+            if row["change_archived"]:
+                archived.append(row["change_id"])
+            elif row["change_deleted"]:
+                deleted.append(row["change_id"])
+            else:
+                booking = booking_from_row(row)
+                for key in ("change_version", "change_deleted", "change_archived", "change_id"):
+                    del booking[key]
+                bookings.append(booking)
+        version = rows[-1]["change_version"] if more else current
+        return {"version": version, "instance": state["instance"], "more": more, "reset": reset,
+                "bookings": bookings, "deleted": deleted, "archived": archived}
+
+    def count_bookings(self, include_archived=False, **filters):
+        clauses, params = booking_filter_clause(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        tables = ["bookings", "bookings_archive"] if include_archived else ["bookings"]
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            return sum(cursor.execute(f"SELECT COUNT(*) FROM {table} b {where}", params).fetchone()[0]
+                       for table in tables)
+
+    def get_customer_history(self, phone, include_archived=False):
+        # История заказов клиента по нормализованному телефону, новые сверху
+        normalized = normalize_phone(phone)
+        if normalized is None:
+            return None
+        query, params = tiered_select("WHERE b.phone_normalized = ?", [normalized], include_archived)
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"{query} ORDER BY date DESC, id DESC", params)
+            bookings = [booking_from_row(row) for row in cursor.fetchall()]
+        return {
+            "phone": normalized,
+            "booking_count": len(bookings),
+            "completed_count": sum(1 for booking in bookings if booking["completed"]),
+            "lifetime_spend": sum(booking["total_price"] for booking in bookings),
+            "bookings": bookings,
+        }
+
+    def get_revenue(self, date_from, date_to, group="day", completed=None):
+        if group == "month":
+            table, period, date_from, date_to = "revenue_monthly", "month", date_from[:7], date_to[:7]
+        else:
+            table, period = "revenue_daily", "date"
+        clauses = [f"{period} BETWEEN ? AND ?", "bookings != 0"]
+        params = [date_from, date_to]
+        if completed is not None:
+            clauses.append("completed = ?")
+            params.append(int(completed))
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT {period} AS period, event_type, NULLIF(program_id, 0) AS program_id, completed, bookings, guests, revenue
+                FROM {table} WHERE {' AND '.join(clauses)} ORDER BY period, event_type, program_id, completed
+            """, params)
             return [dict(row) for row in cursor.fetchall()]
 
-    def get_masterclasses(self):
+    def get_item_sales(self, date_from, date_to):
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM masterclasses")
+            cursor.execute("""
+                SELECT item_type, item_id, SUM(quantity) AS quantity, SUM(seats) AS seats
+                FROM item_sales_daily WHERE date BETWEEN ? AND ?
+                GROUP BY item_type, item_id HAVING SUM(quantity) != 0 ORDER BY item_type, item_id
+            """, (date_from, date_to))
             return [dict(row) for row in cursor.fetchall()]
 
-    def add_program(self, name, price):
+    def rebuild_rollups(self):
+        with self.db.get_connection() as conn:
+            with immediate_transaction(conn):
+                rebuild_rollups(conn.cursor())
+
+    def delete_booking(self, booking_id):
+        return self._write(self._delete_booking, booking_id)
+
+    def _delete_booking(self, conn, booking_id):
+        if conn.execute("DELETE FROM bookings WHERE id = ?", (booking_id,)).rowcount == 0:
+            return False
+        self._record_event(conn, "deleted", booking_id, {"id": booking_id})
+        return True
+
+    def mark_booking_completed(self, booking_id):
+        return self._write(self._complete_booking, booking_id)
+
+    def _complete_booking(self, conn, booking_id):
+        if conn.execute("UPDATE bookings SET completed = 1 WHERE id = ?", (booking_id,)).rowcount == 0:
+            return False
+        self._record_event(conn, "completed", booking_id, {"id": booking_id})
+        return True
+
+    def archive_bookings(self, before_date, batch_size=1000, pause=0.05):
+        # Перенос завершённых заказов с датой раньше before_date в архив порциями по batch_size.
+        # Каждая порция - отдельная короткая транзакция, между порциями пауза: запись заказов не ждёт
+        # весь перенос. Сводные таблицы и занятость не меняются - статистика по-прежнему учитывает
+        # архивные заказы. Возвращает число перенесённых заказов
+        archived = 0
+        while True:
+            with self.db.get_connection() as conn:
+                with immediate_transaction(conn):
+                    moved = self._archive_batch(conn, before_date, batch_size)
+            archived += moved
+            if moved < batch_size:
+                return archived
+            time.sleep(pause)
+
+    def _archive_batch(self, conn, before_date, batch_size):
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM bookings WHERE completed = 1 AND date < ? ORDER BY date, id LIMIT ?",
+                       (before_date, batch_size))
+        ids = [(row[0],) for row in cursor.fetchall()]
+        if not ids:
+            return 0
+        archived_at = time.time()
+        cursor.execute("UPDATE meta SET value = 1 WHERE key = 'archiving'")
+        cursor.executemany("""
+            INSERT INTO bookings_archive (id, date, event_type, guest_count, phone, phone_normalized, child_name,
+                                          program_id, total_price, completed, archived_at)
+            SELECT id, date, event_type, guest_count, phone, phone_normalized, child_name,
+                   program_id, total_price, completed, ?
+            FROM bookings WHERE id = ?
+        """, [(archived_at, *booking_id) for booking_id in ids])
+        cursor.executemany("INSERT INTO booking_addons_archive (booking_id, addon_id) "
+                           "SELECT booking_id, addon_id FROM booking_addons WHERE booking_id = ?", ids)
+        cursor.executemany("INSERT INTO booking_masterclasses_archive (booking_id, masterclass_id) "
+                           "SELECT booking_id, masterclass_id FROM booking_masterclasses WHERE booking_id = ?", ids)
+        cursor.executemany("DELETE FROM bookings WHERE id = ?", ids)
+        cursor.execute("UPDATE meta SET value = 0 WHERE key = 'archiving'")
+        self._record_event(conn, "archived", None, {"count": len(ids)})
+        return len(ids)
+
+    def _record_event(self, conn, kind, booking_id, data):
+        conn.execute("INSERT INTO booking_events (kind, booking_id, data, created_at) VALUES (?, ?, ?, ?)",
+                     (kind, booking_id, json.dumps(data, ensure_ascii=False), time.time()))
+
+    def get_events(self, after, limit=500):
+        # data остаётся строкой JSON: в поток событий она уходит как есть
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("INSERT INTO programs (name, price) VALUES (?, ?)", (name, price))
-            return cursor.lastrowid
+            cursor.execute("SELECT id, kind, data FROM booking_events WHERE id > ? ORDER BY id LIMIT ?", (after, limit))
+            return [tuple(row) for row in cursor.fetchall()]
 
-    def add_addon(self, name, price):
+    def get_event_bounds(self):
+        # Номер самого старого хранимого события (None, если журнал пуст) и последнего выданного номера.
+        # Последний номер берётся из sqlite_sequence, чтобы он не уменьшался после очистки журнала
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("INSERT INTO addons (name, price) VALUES (?, ?)", (name, price))
-            return cursor.lastrowid
+            cursor.execute("SELECT MIN(id) FROM booking_events")
+            oldest = cursor.fetchone()[0]
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'booking_events'")
+            row = cursor.fetchone()
+            return oldest, row[0] if row else 0
+
+    def prune_events(self, before):
+        with self.db.get_connection() as conn:
+            with immediate_transaction(conn):
+                return conn.execute("DELETE FROM booking_events WHERE created_at < ?", (before,)).rowcount
+
+    def get_programs(self):
+        return [dict(row) for row in self.get_catalog().programs]
+
+    def get_addons(self):
+        return [dict(row) for row in self.get_catalog().addons]
+
+    def get_masterclasses(self):
+        return [dict(row) for row in self.get_catalog().masterclasses]
+
+    def add_program(self, name, price):
+        with self.db.get_connection() as conn:
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                cursor.execute("INSERT INTO programs (name, price) VALUES (?, ?)", (name, price))
+                program_id = cursor.lastrowid
+        self.invalidate_catalog()
+        return program_id
+
+    def add_addon(self, name, price):
+        with self.db.get_connection() as conn:
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                cursor.execute("INSERT INTO addons (name, price) VALUES (?, ?)", (name, price))
+                addon_id = cursor.lastrowid
+        self.invalidate_catalog()
+        return addon_id
 
     def add_masterclass(self, name, price_per_child):
         with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO masterclasses (name, price_per_child) VALUES (?, ?)", (name, price_per_child))
-            return cursor.lastrowid
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                cursor.execute("INSERT INTO masterclasses (name, price_per_child) VALUES (?, ?)", (name, price_per_child))
+                masterclass_id = cursor.lastrowid
+        self.invalidate_catalog()
+        return masterclass_id
 
     def delete_program(self, program_id):
         with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM programs WHERE id = ?", (program_id,))
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM programs WHERE id = ?", (program_id,))
+        self.invalidate_catalog()
 
     def delete_addon(self, addon_id):
         with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM addons WHERE id = ?", (addon_id,))
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM addons WHERE id = ?", (addon_id,))
+        self.invalidate_catalog()
 
     def delete_masterclass(self, masterclass_id):
         with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM masterclasses WHERE id = ?", (masterclass_id,))
\ No newline at end of file
+            with immediate_transaction(conn):
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM masterclasses WHERE id = ?", (masterclass_id,))
+        self.invalidate_catalog()
+
+
+class AsyncBookingModel:
+    # Асинхронный вариант BookingModel: блокирующие вызовы sqlite3 выполняются в отдельном пуле потоков,
+    # поэтому долгая запись не останавливает цикл событий. Синхронный BookingModel остаётся для GUI и скриптов.
+    # Хеширование паролей идёт в своём ограниченном пуле, чтобы волна входов не занимала потоки базы.
+    def __init__(self, model: BookingModel, max_workers=4, kdf_workers=2):
+        self.model = model
+        self.db = model.db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self._kdf_executor = ThreadPoolExecutor(max_workers=kdf_workers, thread_name_prefix="kdf")
+
+    def __getattr__(self, name):
+        method = getattr(self.model, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self._run(method, *args, **kwargs)
+
+        call.__name__ = name
+        setattr(self, name, call)
+        return call
+
+    async def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Контекст копируется, чтобы трассировка запросов видела вызовы из пула потоков
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, method, *args, **kwargs))
+
+    async def _write(self, name, op, *args):
+        # С очередью групповой фиксации результат ожидается без занятия потока из пула базы
+        if self.model.write_queue is None:
+            return await self._run(getattr(self.model, name), *args)
+        return await asyncio.wrap_future(self.model.write_queue.submit(op, *args))
+
+    async def create_booking(self, *args):
+        return await self._write("create_booking", self.model._insert_booking, *args)
+
+    async def delete_booking(self, booking_id):
+        return await self._write("delete_booking", self.model._delete_booking, booking_id)
+
+    async def mark_booking_completed(self, booking_id):
+        return await self._write("mark_booking_completed", self.model._complete_booking, booking_id)
+
+    async def _kdf(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._kdf_executor, functools.partial(func, *args, **self.model.kdf_params))
+
+    async def create_user(self, username, password, role="user"):
+        password_hash = await self._kdf(hash_password, password)
+        return await self.add_user(username, password_hash, role)
+
+    async def authenticate_user(self, username, password):
+        credentials = await self.get_credentials(username)
+        if not credentials:
+            return None
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(self._kdf_executor, verify_password, credentials[0], password):
+            return None
+        if needs_rehash(credentials[0], **self.model.kdf_params):
+            await self.update_password_hash(username, await self._kdf(hash_password, password))
+        return credentials[1]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._kdf_executor.shutdown(wait=True)
@@ -0,0 +1,27 @@
+import hashlib
+import hmac
+import secrets
+
+# Параметры scrypt по умолчанию: примерно 16 МБ памяти и десятки миллисекунд на хеш
+DEFAULT_KDF_PARAMS = {"n": 2 ** 14, "r": 8, "p": 1}
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * n * r * p + 1024 * 1024, dklen=32)
+
+
+def hash_password(password, n=DEFAULT_KDF_PARAMS["n"], r=DEFAULT_KDF_PARAMS["r"], p=DEFAULT_KDF_PARAMS["p"]):
+    salt = secrets.token_bytes(16)
+    return f"scrypt${n}${r}${p}${salt.hex()}${_scrypt(password, salt, n, r, p).hex()}"
+
+
+def verify_password(stored, password):
+    if stored.startswith("scrypt$"):
+        _, n, r, p, salt, digest = stored.split("$")
+        return hmac.compare_digest(_scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p)).hex(), digest)
+    # Старый формат: несолёный sha256
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+
+def needs_rehash(stored, n=DEFAULT_KDF_PARAMS["n"], r=DEFAULT_KDF_PARAMS["r"], p=DEFAULT_KDF_PARAMS["p"]):
+    return not stored.startswith(f"scrypt${n}${r}${p}$")
@@ -0,0 +1,12 @@
+import re
+
+
+def normalize_phone(phone):
+    # Приводит номер к виду 7XXXXXXXXXX: "+7 (912) 345-67-89", "8 912 345 67 89" и "9123456789" дают один ключ.
+    # Номера другой длины сохраняются только цифрами; None - если цифр нет совсем
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    elif len(digits) == 10 and digits[0] == "9":
+        digits = "7" + digits
+    return digits or None
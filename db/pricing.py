@@ -0,0 +1,59 @@
+class PriceError(ValueError):
+    pass
+
+
+def _price_table(items, field):
+    # Плоский список цен, индексированный id позиции; None - позиции нет в каталоге
+    prices = [None] * (max((item["id"] for item in items), default=0) + 1)
+    for item in items:
+        prices[item["id"]] = item[field]
+    return prices
+
+
+class PriceEngine:
+    # Расчёт стоимости заказа по снимку каталога; один и тот же движок используют /quote и создание заказов
+    def __init__(self, programs, addons, masterclasses):
+        self.program_prices = _price_table(programs, "price")
+        self.addon_prices = _price_table(addons, "price")
+        self.masterclass_prices = _price_table(masterclasses, "price_per_child")
+
+    def breakdown(self, program_id, addon_ids, masterclass_ids, guest_count):
+        program_prices = self.program_prices
+        addon_prices = self.addon_prices
+        masterclass_prices = self.masterclass_prices
+
+        program_price = program_prices[program_id] if 0 <= program_id < len(program_prices) else None
+        if program_price is None:
+            raise PriceError("Invalid program ID")
+
+        addons_price = 0
+        for addon_id in addon_ids:
+            price = addon_prices[addon_id] if 0 <= addon_id < len(addon_prices) else None
+            if price is None:
+                raise PriceError(f"Invalid addon ID: {addon_id}")
+            addons_price += price
+
+        masterclasses_price = 0
+        for masterclass_id in masterclass_ids:
+            price = masterclass_prices[masterclass_id] if 0 <= masterclass_id < len(masterclass_prices) else None
+            if price is None:
+                raise PriceError(f"Invalid masterclass ID: {masterclass_id}")
+            masterclasses_price += price
+        masterclasses_price *= guest_count
+
+        return program_price, addons_price, masterclasses_price
+
+    def quote(self, program_id, addon_ids, masterclass_ids, guest_count):
+        return sum(self.breakdown(program_id, addon_ids, masterclass_ids, guest_count))
+
+    def quote_many(self, configurations):
+        # Пакетный расчёт: configurations - кортежи (program_id, addon_ids, masterclass_ids, guest_count).
+        # Ошибка одной конфигурации не прерывает расчёт остальных
+        results = []
+        breakdown = self.breakdown
+        for configuration in configurations:
+            try:
+                results.append(breakdown(*configuration))
+            except PriceError as e:
+                results.append(e)
+        return results
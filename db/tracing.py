@@ -0,0 +1,106 @@
+import contextvars
+import logging
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("db.trace")
+
+_current_trace = contextvars.ContextVar("query_trace", default=None)
+
+INTERNAL_SQL = re.compile(r"^\s*--|'\w+'\.")
+
+
+class QueryTrace:
+    # Запросы, выполненные в рамках одного HTTP-запроса или блока кода: текст, длительность, число строк
+    def __init__(self):
+        self.queries = []
+        self._open = None
+
+    def statement(self, sql):
+        # Вызывается sqlite3 перед каждым запросом; предыдущий запрос считается завершённым.
+        # Операторы триггеров и внутренние запросы виртуальных таблиц (FTS5) выполняются в рамках текущего
+        # запроса и отдельно не считаются: sqlite3 сообщает о них строкой с "--" или текстом того же запроса,
+        # а FTS5 обращается к своим таблицам как 'main'.'bookings_fts_data'
+        if INTERNAL_SQL.search(sql) or (self._open is not None and self._open["sql"] == sql):
+            return
+        now = time.perf_counter()
+        self.finish(now)
+        self._open = {"sql": sql, "started": now, "duration": 0.0, "rows": 0}
+        self.queries.append(self._open)
+
+    def row_factory(self, cursor, row):
+        if self._open is not None:
+            self._open["rows"] += 1
+        return sqlite3.Row(cursor, row)
+
+    def finish(self, now=None):
+        if self._open is not None:
+            self._open["duration"] = (now or time.perf_counter()) - self._open["started"]
+            self._open = None
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(query["duration"] for query in self.queries)
+
+    def log(self, label):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        logger.debug("%s: %d queries, %.3f ms", label, self.count, self.total_time * 1000)
+        for query in self.queries:
+            logger.debug("  %.3f ms, %d rows: %s", query["duration"] * 1000, query["rows"], " ".join(query["sql"].split()))
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def attach(conn):
+    # Подключает текущую трассировку к соединению на время блока
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    conn.set_trace_callback(trace.statement)
+    conn.row_factory = trace.row_factory
+    try:
+        yield
+    finally:
+        trace.finish()
+        conn.set_trace_callback(None)
+        conn.row_factory = sqlite3.Row
+
+
+@contextmanager
+def trace_queries():
+    trace = QueryTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _current_trace.reset(token)
+
+
+@contextmanager
+def max_queries(limit):
+    # Для тестов: блок не должен выполнять больше limit запросов
+    with trace_queries() as trace:
+        yield trace
+    if trace.count > limit:
+        statements = "\n".join(query["sql"] for query in trace.queries)
+        raise AssertionError(f"Expected at most {limit} queries, got {trace.count}:\n{statements}")
+
+
+def assert_max_queries(response, limit):
+    # Для тестов API с включённой трассировкой: проверка по заголовку X-DB-Queries
+    count = int(response.headers["X-DB-Queries"])
+    if count > limit:
+        raise AssertionError(f"{response.request.method} {response.request.url.path}: "
+                             f"expected at most {limit} queries, got {count}")
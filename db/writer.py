@@ -0,0 +1,112 @@
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from db import tracing
+from db.database import immediate_transaction
+
+_STOP = object()
+
+
+class WriteQueue:
+    # Единственный поток-писатель с групповой фиксацией: операции, пришедшие почти одновременно,
+    # выполняются в одной транзакции и одним COMMIT. Каждая операция идёт внутри своей точки сохранения,
+    # поэтому ошибка одной (например, нехватка мест) откатывает только её, а остальные фиксируются.
+    # Операция - функция op(conn, *args); результат или исключение возвращаются вызывающему через Future.
+    # Операция выполняется в контексте (contextvars) вызывающего, поэтому её запросы попадают в его трассировку
+    def __init__(self, db, max_batch=64, max_delay=0.002):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.operations = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, op, *args):
+        if self._closed:
+            raise RuntimeError("Write queue is closed")
+        future = Future()
+        self._queue.put((future, contextvars.copy_context(), op, args))
+        return future
+
+    def _collect(self, first):
+        # Ждём попутные операции не дольше max_delay и не больше max_batch штук
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch, stop = self._collect(item)
+            self._commit(batch)
+        # Операции, поставленные одновременно с закрытием, уже не будут выполнены
+        while True:
+            try:
+                future, _, _, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(RuntimeError("Write queue is closed"))
+
+    def _commit(self, batch):
+        outcomes = []
+        try:
+            with self.db.get_connection() as conn:
+                with immediate_transaction(conn):
+                    for future, context, op, args in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        conn.execute("SAVEPOINT write_op")
+                        try:
+                            result = context.run(self._execute, conn, op, args)
+                        except Exception as e:
+                            conn.execute("ROLLBACK TO write_op")
+                            conn.execute("RELEASE write_op")
+                            outcomes.append((future, None, e))
+                        else:
+                            conn.execute("RELEASE write_op")
+                            outcomes.append((future, result, None))
+        except Exception as e:
+            # Транзакция не зафиксирована: ошибку получают все, чья операция прошла успешно
+            for future, _, error in outcomes:
+                future.set_exception(error or e)
+            for future, _, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.operations += len(outcomes)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    @staticmethod
+    def _execute(conn, op, args):
+        with tracing.attach(conn):
+            return op(conn, *args)
+
+    def close(self):
+        # Дожидается выполнения уже поставленных операций
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
@@ -1,17 +1,102 @@
+import json
+import threading
 import requests
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QInputDialog, QMessageBox
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QInputDialog, QMessageBox, QLineEdit
+
+SEARCH_DELAY_MS = 300
+SEARCH_LIMIT = 200
+RECONNECT_DELAY = 3
+SYNC_PAGE_SIZE = 5000
+
+
+class BookingEventListener(QThread):
+    # Читает поток /bookings/events в отдельном потоке и передаёт события в интерфейс сигналом.
+    # После обрыва переподключается и продолжает с последнего полученного события
+    event_received = pyqtSignal(str, dict)
+
+    def __init__(self, token, last_event_id=None, parent=None):
+        super().__init__(parent)
+        self.token = token
+        self.last_event_id = last_event_id
+        self._stopped = threading.Event()
+        self._response = None
+
+    def run(self):
+        while not self._stopped.is_set():
+            headers = {"Authorization": f"Bearer {self.token}"}
+            if self.last_event_id is not None:
+                headers["Last-Event-ID"] = str(self.last_event_id)
+            try:
+                # Сервер шлёт keep-alive каждые 15 секунд, так что минута тишины - обрыв соединения
+                self._response = requests.get("http://localhost:8000/bookings/events", headers=headers,
+                                              stream=True, timeout=(5, 60))
+                self._response.raise_for_status()
+                self._read(self._response)
+            except Exception:
+                pass
+            finally:
+                if self._response is not None:
+                    self._response.close()
+                    self._response = None
+            self._stopped.wait(RECONNECT_DELAY)
+
+    def _read(self, response):
+        event_id, kind, data = None, "message", []
+        for line in response.iter_lines(decode_unicode=True):
+            if self._stopped.is_set():
+                return
+            if line.startswith(":"):
+                continue
+            if line:
+                field, _, value = line.partition(":")
+                value = value[1:] if value.startswith(" ") else value
+                if field == "id":
+                    event_id = int(value)
+                elif field == "event":
+                    kind = value
+                elif field == "data":
+                    data.append(value)
+                continue
+            if data:
+                self.event_received.emit(kind, json.loads("\n".join(data)))
+            if event_id is not None:
+                self.last_event_id = event_id
+            event_id, kind, data = None, "message", []
+
+    def stop(self):
+        self._stopped.set()
+        response = self._response
+        if response is not None:
+            response.close()
+        self.wait(2000)
 
 
 class AdminPanel(QWidget):
     def __init__(self):
         super().__init__()
         self.token = None
+        self.listener = None
+        self.last_event_id = None
+        self.sync_version = None
+        self.sync_instance = None
         self.init_ui()
 
     def init_ui(self):
         layout = QVBoxLayout()
         layout.setSpacing(10)
 
+        # Поиск по имени ребенка, телефону и типу события: запрос уходит после паузы в наборе
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Поиск по имени, телефону или типу события")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.run_search)
+        self.search_input.textChanged.connect(lambda _text: self.search_timer.start())
+        layout.addWidget(self.search_input)
+
         # Bookings Table
         self.table = QTableWidget()
         self.table.setColumnCount(11)
@@ -26,7 +111,7 @@ class AdminPanel(QWidget):
         btn_layout.setSpacing(10)
 
         self.refresh_btn = QPushButton("Обновить заказы")
-        self.refresh_btn.clicked.connect(self.load_bookings)
+        self.refresh_btn.clicked.connect(self.refresh)
         btn_layout.addWidget(self.refresh_btn)
 
         self.delete_btn = QPushButton("Удалить заказ")
@@ -106,30 +191,150 @@ class AdminPanel(QWidget):
     def set_token(self, token):
         self.token = token
         self.load_bookings()
+        self.start_listener()
 
-    def load_bookings(self):
+    def start_listener(self):
+        # Изменения заказов приходят потоком событий и применяются к таблице без перезагрузки
+        self.stop_listener()
+        self.listener = BookingEventListener(self.token, self.last_event_id, self)
+        self.listener.event_received.connect(self.apply_event)
+        self.listener.start()
+
+    def stop_listener(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def closeEvent(self, event):
+        self.stop_listener()
+        super().closeEvent(event)
+
+    def find_row(self, booking_id):
+        for row in range(self.table.rowCount()):
+            item = self.table.item(row, 0)
+            if item is not None and item.text() == str(booking_id):
+                return row
+        return None
+
+    def apply_event(self, kind, data):
+        # События идемпотентны: повторное применение (например, после перезагрузки списка) ничего не меняет
+        if kind == "created":
+            # В режиме поиска таблица показывает только найденное, новые заказы в неё не добавляются
+            if self.search_input.text().strip() or self.find_row(data["id"]) is not None:
+                return
+            row = self.table.rowCount()
+            self.table.insertRow(row)
+            self.fill_row(row, data)
+        elif kind == "completed":
+            row = self.find_row(data["id"])
+            if row is not None:
+                self.table.setItem(row, 10, QTableWidgetItem("Завершено"))
+        elif kind == "deleted":
+            row = self.find_row(data["id"])
+            if row is not None:
+                self.table.removeRow(row)
+        elif kind in ("imported", "archived", "reset"):
+            self.refresh()
+
+    def refresh(self):
+        if self.search_input.text().strip():
+            self.run_search()
+        else:
+            self.load_bookings()
+
+    def run_search(self):
+        query = self.search_input.text().strip()
+        if not query:
+            self.load_bookings()
+            return
         try:
             headers = {"Authorization": f"Bearer {self.token}"}
-            response = requests.get("http://localhost:8000/bookings/", headers=headers)
+            response = requests.get("http://localhost:8000/bookings/search", headers=headers,
+                                    params={"q": query, "limit": SEARCH_LIMIT})
             response.raise_for_status()
-            bookings = response.json()
-            self.table.setRowCount(len(bookings))
-            for row, booking in enumerate(bookings):
-                self.table.setItem(row, 0, QTableWidgetItem(str(booking["id"])))
-                self.table.setItem(row, 1, QTableWidgetItem(booking["date"]))
-                self.table.setItem(row, 2, QTableWidgetItem(booking["event_type"]))
-                self.table.setItem(row, 3, QTableWidgetItem(str(booking["guest_count"])))
-                self.table.setItem(row, 4, QTableWidgetItem(booking["phone"]))
-                self.table.setItem(row, 5, QTableWidgetItem(booking["child_name"]))
-                self.table.setItem(row, 6, QTableWidgetItem(str(booking["program_id"])))
-                self.table.setItem(row, 7, QTableWidgetItem(str(booking["addon_ids"])))
-                self.table.setItem(row, 8, QTableWidgetItem(str(booking["masterclass_ids"])))
-                self.table.setItem(row, 9, QTableWidgetItem(str(booking["total_price"])))
-                status = "Завершено" if booking["completed"] else "Активно"
-                self.table.setItem(row, 10, QTableWidgetItem(status))
+            self.fill_table(response.json())
+            # Таблица больше не повторяет полный список: следующая загрузка будет полной
+            self.sync_version = None
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось выполнить поиск: {str(e)}")
+
+    def load_bookings(self):
+        # Дельта-синхронизация: запрашиваются только заказы, изменённые после self.sync_version.
+        # Первая загрузка (и загрузка после результатов поиска) - те же изменения с нулевой версии
+        try:
+            headers = {"Authorization": f"Bearer {self.token}"}
+            full = self.sync_version is None
+            params = {"since": self.sync_version or 0, "instance": self.sync_instance, "limit": SYNC_PAGE_SIZE}
+            bookings = {}
+            deleted = set()
+            first_page = True
+            while True:
+                response = requests.get("http://localhost:8000/bookings/changes", headers=headers, params=params)
+                response.raise_for_status()
+                changes = response.json()
+                if changes["reset"]:
+                    full = True
+                    bookings.clear()
+                    deleted.clear()
+                # Поток событий продолжается с номера, прочитанного до первой страницы полной загрузки
+                if full and first_page and "X-Last-Event-Id" in response.headers:
+                    self.last_event_id = int(response.headers["X-Last-Event-Id"])
+                first_page = False
+                for booking in changes["bookings"]:
+                    bookings[booking["id"]] = booking
+                    deleted.discard(booking["id"])
+                # Таблица показывает только оперативные заказы: перенесённые в архив из неё убираются
+                for booking_id in changes["deleted"] + changes["archived"]:
+                    bookings.pop(booking_id, None)
+                    deleted.add(booking_id)
+                params["since"] = changes["version"]
+                params["instance"] = changes["instance"]
+                if not changes["more"]:
+                    break
+            self.sync_version = params["since"]
+            self.sync_instance = params["instance"]
+            if full:
+                self.fill_table(sorted(bookings.values(), key=lambda booking: (booking["date"], booking["id"])))
+            else:
+                self.apply_changes(bookings.values(), deleted)
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить заказы: {str(e)}")
 
+    def table_rows(self):
+        return {int(self.table.item(row, 0).text()): row for row in range(self.table.rowCount())
+                if self.table.item(row, 0) is not None}
+
+    def apply_changes(self, bookings, deleted):
+        rows = self.table_rows()
+        for row in sorted((rows[booking_id] for booking_id in deleted if booking_id in rows), reverse=True):
+            self.table.removeRow(row)
+        rows = self.table_rows()
+        for booking in bookings:
+            row = rows.get(booking["id"])
+            if row is None:
+                row = self.table.rowCount()
+                self.table.insertRow(row)
+            self.fill_row(row, booking)
+
+    def fill_table(self, bookings):
+        self.table.setRowCount(len(bookings))
+        for row, booking in enumerate(bookings):
+            self.fill_row(row, booking)
+
+    def fill_row(self, row, booking):
+        self.table.setItem(row, 0, QTableWidgetItem(str(booking["id"])))
+        self.table.setItem(row, 1, QTableWidgetItem(booking["date"]))
+        self.table.setItem(row, 2, QTableWidgetItem(booking["event_type"]))
+        self.table.setItem(row, 3, QTableWidgetItem(str(booking["guest_count"])))
+        self.table.setItem(row, 4, QTableWidgetItem(booking["phone"]))
+        self.table.setItem(row, 5, QTableWidgetItem(booking["child_name"]))
+        self.table.setItem(row, 6, QTableWidgetItem(str(booking["program_id"])))
+        self.table.setItem(row, 7, QTableWidgetItem(str(booking["addon_ids"])))
+        self.table.setItem(row, 8, QTableWidgetItem(str(booking["masterclass_ids"])))
+        self.table.setItem(row, 9, QTableWidgetItem(str(booking["total_price"])))
+        status = "Завершено" if booking["completed"] else "Активно"
+        self.table.setItem(row, 10, QTableWidgetItem(status))
+
     def delete_booking(self):
         selected = self.table.currentRow()
         if selected < 0:
@@ -140,7 +345,7 @@ class AdminPanel(QWidget):
             headers = {"Authorization": f"Bearer {self.token}"}
             response = requests.delete(f"http://localhost:8000/bookings/{booking_id}", headers=headers)
             response.raise_for_status()
-            self.load_bookings()
+            self.apply_event("deleted", {"id": booking_id})
             QMessageBox.information(self, "Успех", "Заказ удален")
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось удалить заказ: {str(e)}")
@@ -155,7 +360,7 @@ class AdminPanel(QWidget):
             headers = {"Authorization": f"Bearer {self.token}"}
             response = requests.put(f"http://localhost:8000/bookings/{booking_id}/complete", headers=headers)
             response.raise_for_status()
-            self.load_bookings()
+            self.apply_event("completed", {"id": booking_id})
             QMessageBox.information(self, "Успех", "Заказ отмечен как завершенный")
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось отметить заказ: {str(e)}")
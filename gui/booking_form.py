@@ -7,6 +7,7 @@ class BookingForm(QWidget):
     def __init__(self):
         super().__init__()
         self.token = None  # Store the token
+        self.catalog_cache = {}  # url -> (ETag, данные)
         self.init_ui()
 
     def init_ui(self):
@@ -29,8 +30,11 @@ class BookingForm(QWidget):
         self.date_edit = QDateEdit()
         self.date_edit.setCalendarPopup(True)
         self.date_edit.setMinimumDate(QDate.currentDate())
+        self.date_edit.dateChanged.connect(self.update_availability)
         event_layout.addWidget(QLabel("Дата:"), 1, 0)
         event_layout.addWidget(self.date_edit, 1, 1)
+        self.availability_label = QLabel("")
+        event_layout.addWidget(self.availability_label, 1, 2)
 
         # Guest Count
         self.guest_count = QLineEdit()
@@ -127,14 +131,26 @@ class BookingForm(QWidget):
     def set_token(self, token):
         self.token = token
         self.load_data()
+        self.update_availability()
+
+    def update_availability(self):
+        if not self.token:
+            return
+        day = self.date_edit.date().toString("yyyy-MM-dd")
+        try:
+            headers = {"Authorization": f"Bearer {self.token}"}
+            response = requests.get("http://localhost:8000/availability", params={"from": day, "to": day}, headers=headers)
+            response.raise_for_status()
+            remaining = response.json()[0]["remaining"]
+            self.availability_label.setText("" if remaining is None else f"Свободно мест: {remaining}")
+        except Exception:
+            self.availability_label.setText("")
 
     def load_data(self):
         try:
             headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
             # Load programs
-            response = requests.get("http://localhost:8000/programs/", headers=headers)
-            response.raise_for_status()
-            programs = response.json()
+            programs = self.fetch_catalog("http://localhost:8000/programs/", headers)
             if not isinstance(programs, list):
                 raise ValueError("Programs data is not a list")
             self.program.clear()
@@ -142,9 +158,7 @@ class BookingForm(QWidget):
             self.program.setProperty("programs", programs)
 
             # Load add-ons
-            response = requests.get("http://localhost:8000/addons/", headers=headers)
-            response.raise_for_status()
-            addons = response.json()
+            addons = self.fetch_catalog("http://localhost:8000/addons/", headers)
             if not isinstance(addons, list):
                 raise ValueError("Addons data is not a list")
             for checkbox in self.addon_checkboxes:
@@ -157,9 +171,7 @@ class BookingForm(QWidget):
                 self.addon_checkboxes.append(checkbox)
 
             # Load masterclasses
-            response = requests.get("http://localhost:8000/masterclasses/", headers=headers)
-            response.raise_for_status()
-            masterclasses = response.json()
+            masterclasses = self.fetch_catalog("http://localhost:8000/masterclasses/", headers)
             if not isinstance(masterclasses, list):
                 raise ValueError("Masterclasses data is not a list")
             for checkbox in self.masterclass_checkboxes:
@@ -174,6 +186,21 @@ class BookingForm(QWidget):
             QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить данные: {str(e)}")
             self.program.setProperty("programs", [])
 
+    def fetch_catalog(self, url, headers):
+        # Каталог меняется редко: отправляем ETag сохранённой копии и при ответе 304 используем её
+        cached = self.catalog_cache.get(url)
+        request_headers = dict(headers)
+        if cached:
+            request_headers["If-None-Match"] = cached[0]
+        response = requests.get(url, headers=request_headers)
+        if response.status_code == 304 and cached:
+            return cached[1]
+        response.raise_for_status()
+        data = response.json()
+        if "ETag" in response.headers:
+            self.catalog_cache[url] = (response.headers["ETag"], data)
+        return data
+
     def submit_booking(self):
         try:
             guest_count = int(self.guest_count.text())
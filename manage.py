@@ -0,0 +1,33 @@
+import argparse
+import datetime
+import config
+from db.database import Database
+from db.models import BookingModel
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных бронирований")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild-rollups", help="Пересчитать сводные таблицы выручки и продаж по заказам")
+    archive = commands.add_parser("archive", help="Перенести старые завершённые заказы в архив")
+    archive.add_argument("--days", type=int, default=config.ARCHIVE_AFTER_DAYS,
+                         help="переносить заказы с датой раньше, чем столько дней назад")
+    archive.add_argument("--batch-size", type=int, default=config.ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    db = Database(config.DB_NAME)
+    model = BookingModel(db)
+    try:
+        if args.command == "rebuild-rollups":
+            model.rebuild_rollups()
+            print("Сводные таблицы пересчитаны")
+        elif args.command == "archive":
+            before = (datetime.date.today() - datetime.timedelta(days=args.days)).isoformat()
+            archived = model.archive_bookings(before, args.batch_size)
+            print(f"Перенесено в архив заказов: {archived} (с датой раньше {before})")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+
+# Заголовки X-DB-Queries нужны тестам числа запросов; настройка читается при импорте api.routers
+os.environ.setdefault("EVENTS_SQL_TRACE", "1")
+os.environ.setdefault("EVENTS_KDF_N", str(2 ** 4))
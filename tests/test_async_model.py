@@ -0,0 +1,51 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from db.database import Database
+from db.models import AsyncBookingModel, BookingModel
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = Database(str(tmp_path / "events.db"), timeout=5.0)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def model(database):
+    model = AsyncBookingModel(BookingModel(database, kdf_params={"n": 2 ** 4, "r": 8, "p": 1}), max_workers=4)
+    yield model
+    model.close()
+
+
+@pytest.fixture
+def other_connection(database):
+    # Соединение другого процесса (GUI, скрипта), которое будет держать блокировку записи
+    conn = sqlite3.connect(database.db_name, isolation_level=None)
+    yield conn
+    if conn.in_transaction:
+        conn.rollback()
+    conn.close()
+
+
+def test_reads_proceed_while_write_transaction_held(model, other_connection):
+    async def scenario():
+        booking_id = await model.create_booking("2026-06-01", "День рождения", 5, "+7 900 000-00-01", "Маша", 1,
+                                                [1], [], 12000)
+        other_connection.execute("BEGIN IMMEDIATE")
+        other_connection.execute("INSERT INTO programs (name, price) VALUES ('Заблокированная', 1)")
+        # Запись ждёт блокировку в потоке пула, цикл событий и чтения при этом не стоят
+        pending_write = asyncio.ensure_future(model.mark_booking_completed(booking_id))
+        await asyncio.sleep(0.05)
+        bookings, _ = await asyncio.wait_for(model.get_bookings(), timeout=1.0)
+        catalog = await asyncio.wait_for(model.get_catalog(), timeout=1.0)
+        assert [booking["id"] for booking in bookings] == [booking_id]
+        assert "Заблокированная" not in {program["name"] for program in catalog.programs}
+        assert not pending_write.done()
+        other_connection.execute("COMMIT")
+        assert await asyncio.wait_for(pending_write, timeout=5.0)
+
+    asyncio.run(scenario())
@@ -0,0 +1,56 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import config
+from api.routers import app
+from db.database import Database
+from db.models import BookingModel
+from db.tracing import assert_max_queries, max_queries
+
+BOOKING = {"date": "2026-06-01", "event_type": "День рождения", "guest_count": 5, "phone": "+7 (912) 345-67-89",
+           "child_name": "Маша", "program_id": 1, "addon_ids": [1, 3], "masterclass_ids": [2]}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DB_NAME", str(tmp_path / "events.db"))
+    monkeypatch.setattr(config, "SECRET_KEY_FILE", str(tmp_path / "secret.key"))
+    with TestClient(app) as client:
+        response = client.post("/login/", json={"username": "admin", "password": "admin123"})
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        yield client
+
+
+@pytest.fixture
+def model(tmp_path):
+    db = Database(str(tmp_path / "events.db"))
+    yield BookingModel(db)
+    db.close()
+
+
+def test_booking_endpoints_query_caps(client):
+    # Число запросов к базе на вызов не должно зависеть от числа заказов, доп. услуг и мастер-классов
+    client.post("/bookings/", json=BOOKING)
+    for _ in range(3):
+        response = client.post("/bookings/", json=BOOKING)
+        assert_max_queries(response, 6)
+    booking_id = response.json()["booking_id"]
+    assert_max_queries(client.get("/bookings/", params={"limit": 2}), 2)
+    assert_max_queries(client.get("/bookings/search", params={"q": "912"}), 2)
+    assert_max_queries(client.get("/customers/89123456789/bookings"), 1)
+    assert_max_queries(client.get("/bookings/changes"), 4)
+    assert_max_queries(client.get("/stats/revenue", params={"from": "2026-06-01", "to": "2026-06-30"}), 1)
+    assert_max_queries(client.put(f"/bookings/{booking_id}/complete"), 2)
+    assert_max_queries(client.delete(f"/bookings/{booking_id}"), 2)
+
+
+def test_booking_list_is_one_query(model):
+    for i in range(20):
+        model.create_booking("2026-06-01", "День рождения", 1, f"+7 900 000-00-{i:02d}", "Маша", 1, [1, 3], [2], 12000)
+    with max_queries(1):
+        bookings, _ = model.get_bookings(limit=20)
+    assert len(bookings) == 20
+    assert all(booking["addon_ids"] == [1, 3] and booking["masterclass_ids"] == [2] for booking in bookings)
+    with max_queries(1):
+        history = model.get_customer_history("8 900 000 00 05", include_archived=True)
+    assert history["booking_count"] == 1